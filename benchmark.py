@@ -0,0 +1,484 @@
+"""excel2json.py 性能测试: 生成测试用的Excel表格, 统计每个阶段的耗时和内存
+
+    # 生成1万行的表格并测试, 结果保存为JSON
+    python benchmark.py --rows 10000 --output result.json
+    # 与之前保存的结果比较, 任意阶段的中位数慢20%以上(并且多于--min_delta秒)时返回1
+    python benchmark.py --rows 10000 --baseline result.json --threshold 0.2
+    # 测试已有的表格目录
+    python benchmark.py --excel_dir ./excels
+
+生成的表格:
+    BenchItem.xls   list  外表, 每组fanout行, 主表按group字段引用一组
+    Bench.xls       list  主表, 基础类型字段 + 数组字段(arr_0..arr_n, int[]) + 外键字段
+    BenchDict.xls   dict
+    BenchMat.xls    matrix       稠密矩阵
+    BenchCsr.xls    matrix(csr)  稀疏矩阵
+
+.xls最多65536行256列, 更大的表格使用 --format xlsx(由xlsxreader.py流式读取)。生成.xls需要安装xlwt, .xlsx不需要额外的库。
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import statistics
+import platform
+import tempfile
+import tracemalloc
+from xml.sax.saxutils import escape
+
+import excel2json
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+XLS_MAX_ROWS = 65536
+XLS_MAX_COLS = 256
+
+HEAD_ROWS = 5
+
+
+class XlsWriter:
+    def __init__(self):
+        import xlwt
+        self.book = xlwt.Workbook()
+
+    def add_sheet(self, name, rows):
+        ws = self.book.add_sheet(name)
+        for r, row in enumerate(rows):
+            if r >= XLS_MAX_ROWS:
+                raise Exception('{0} has more than {1} rows, please use --format xlsx'.format(name, XLS_MAX_ROWS))
+            for c, v in enumerate(row):
+                if v is not None and v != '':
+                    ws.write(r, c, v)
+
+    def save(self, filepath):
+        self.book.save(filepath)
+
+
+def get_column_name(c):
+    name = ''
+    c += 1
+    while c:
+        c, rem = divmod(c - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+class XlsxWriter:
+    """最简单的.xlsx写入, 字符串使用inlineStr, 逐行写入zip不在内存中保存整个表格"""
+    def __init__(self):
+        self.sheets = []
+
+    def add_sheet(self, name, rows):
+        self.sheets.append((name, rows))
+
+    def save(self, filepath):
+        with zipfile.ZipFile(filepath, mode='w', compression=zipfile.ZIP_DEFLATED) as z:
+            overrides = ''.join(
+                '<Override PartName="/xl/worksheets/sheet{0}.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(i + 1)
+                for i in range(len(self.sheets)))
+            z.writestr('[Content_Types].xml',
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                + overrides + '</Types>')
+            z.writestr('_rels/.rels',
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+                'Target="xl/workbook.xml"/></Relationships>')
+            sheets = ''.join('<sheet name="{0}" sheetId="{1}" r:id="rId{1}"/>'.format(escape(name), i + 1)
+                             for i, (name, rows) in enumerate(self.sheets))
+            z.writestr('xl/workbook.xml',
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<sheets>' + sheets + '</sheets></workbook>')
+            rels = ''.join(
+                '<Relationship Id="rId{0}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                'Target="worksheets/sheet{0}.xml"/>'.format(i + 1) for i in range(len(self.sheets)))
+            z.writestr('xl/_rels/workbook.xml.rels',
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' + rels + '</Relationships>')
+            for i, (name, rows) in enumerate(self.sheets):
+                with z.open('xl/worksheets/sheet{0}.xml'.format(i + 1), mode='w') as f:
+                    self.write_sheet(f, rows)
+
+    def write_sheet(self, f, rows):
+        f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+        col_names = []
+        for r, row in enumerate(rows):
+            cells = []
+            for c, v in enumerate(row):
+                if v is None or v == '':
+                    continue
+                while len(col_names) <= c:
+                    col_names.append(get_column_name(len(col_names)))
+                ref = '{0}{1}'.format(col_names[c], r + 1)
+                if type(v) == str:
+                    cells.append('<c r="{0}" t="inlineStr"><is><t>{1}</t></is></c>'.format(ref, escape(v)))
+                elif type(v) == bool:
+                    cells.append('<c r="{0}" t="b"><v>{1}</v></c>'.format(ref, int(v)))
+                else:
+                    cells.append('<c r="{0}"><v>{1}</v></c>'.format(ref, v))
+            f.write('<row r="{0}">{1}</row>'.format(r + 1, ''.join(cells)).encode('utf-8'))
+        f.write(b'</sheetData></worksheet>')
+
+
+def get_writer(fmt):
+    if fmt == 'xls':
+        return XlsWriter()
+    if fmt == 'xlsx':
+        return XlsxWriter()
+    raise Exception('unknown format {0}'.format(fmt))
+
+
+def iter_list_rows(names, types, filters, data_rows):
+    yield [excel2json.CON_LIST]
+    yield names
+    yield types
+    yield filters
+    yield names
+    for row in data_rows:
+        yield row
+
+
+def generate_workbooks(out_dir, rows=1000, cols=8, fanout=4, arrays=3, matrix=100, density=0.05, fmt='xls', seed=1):
+    """生成测试用的表格
+
+    Args:
+        out_dir:str
+        rows:int 主表行数
+        cols:int 主表基础类型字段数量(不包括id/name/数组/外键)
+        fanout:int 每个外键引用的外表行数
+        arrays:int 主表中arr_0..arr_n数组字段的数量
+        matrix:int 矩阵的行数和列数
+        density:float 稀疏矩阵非0值的比例
+        fmt:str xls/xlsx
+        seed:int
+
+    Returns:
+        list 生成的文件
+    """
+    rnd = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    ext = '.' + fmt
+    if fmt == 'xls':
+        if rows + HEAD_ROWS > XLS_MAX_ROWS or matrix + 1 > XLS_MAX_ROWS:
+            raise Exception('.xls supports at most {0} rows, please use --format xlsx'.format(XLS_MAX_ROWS))
+        if cols + arrays + 4 > XLS_MAX_COLS or matrix + 1 > XLS_MAX_COLS:
+            raise Exception('.xls supports at most {0} columns, please use --format xlsx'.format(XLS_MAX_COLS))
+
+    filepaths = []
+    def save(name, writer):
+        filepath = os.path.join(out_dir, name + ext)
+        writer.save(filepath)
+        filepaths.append(filepath)
+
+    # 外表: 每组fanout行
+    groups = max(1, rows // 10)
+    basic_types = [excel2json.INT, excel2json.FLOAT, excel2json.STRING, excel2json.BOOL]
+    def basic_value(t, i):
+        if t == excel2json.INT:
+            return rnd.randint(0, 100000)
+        if t == excel2json.FLOAT:
+            return rnd.randint(0, 10000) / 4.0
+        if t == excel2json.STRING:
+            return 'text{0}'.format(i % 997)
+        return rnd.randint(0, 1)
+
+    writer = get_writer(fmt)
+    names = ['id', 'group', 'weight', 'label']
+    types = [excel2json.INT, excel2json.INT, excel2json.INT, excel2json.STRING]
+    filters = ['', '', '', 'c']
+    writer.add_sheet('BenchItem', iter_list_rows(names, types, filters,
+        ([g * fanout + j, g, rnd.randint(1, 100), 'item{0}'.format(j)] for g in range(groups) for j in range(fanout))))
+    save('BenchItem', writer)
+
+    # 主表
+    writer = get_writer(fmt)
+    col_types = [basic_types[c % len(basic_types)] for c in range(cols)]
+    names = ['id', 'name'] + ['f{0}'.format(c) for c in range(cols)] + ['arr_{0}'.format(c) for c in range(arrays)] + ['list', 'items']
+    types = [excel2json.INT, excel2json.STRING] + col_types + [excel2json.INT] * arrays + ['int[]', 'BenchItem[]|group']
+    filters = ['', ''] + ['c' if c % 3 == 2 else '' for c in range(cols)] + [''] * arrays + ['s', '']
+    def bench_rows():
+        for i in range(rows):
+            row = [i, 'name{0}'.format(i)]
+            row += [basic_value(t, i) for t in col_types]
+            row += [rnd.randint(0, 1000) for c in range(arrays)]
+            row.append(','.join(str(rnd.randint(0, 99)) for c in range(3)))
+            row.append(i % groups)
+            yield row
+    writer.add_sheet('Bench', iter_list_rows(names, types, filters, bench_rows()))
+    save('Bench', writer)
+
+    writer = get_writer(fmt)
+    def dict_rows():
+        yield [excel2json.CON_DICT]
+        yield ['key', 'value', 'text']
+        yield [excel2json.INT, excel2json.INT, excel2json.STRING]
+        yield ['', '', '']
+        yield ['key', 'value', 'text']
+        for i in range(rows):
+            yield [i, rnd.randint(0, 100000), 'value{0}'.format(i % 101)]
+    writer.add_sheet('BenchDict', dict_rows())
+    save('BenchDict', writer)
+
+    def matrix_rows(con_type, p):
+        yield [con_type] + list(range(1, matrix + 1))
+        for r in range(matrix):
+            yield [r + 1] + [rnd.randint(1, 100) if rnd.random() < p else '' for c in range(matrix)]
+
+    writer = get_writer(fmt)
+    writer.add_sheet('BenchMat', matrix_rows(excel2json.CON_MATRIX, 1.0))
+    save('BenchMat', writer)
+
+    writer = get_writer(fmt)
+    writer.add_sheet('BenchCsr', matrix_rows(excel2json.CON_MATRIX_CSR, density))
+    save('BenchCsr', writer)
+    return filepaths
+
+
+def get_rss_mb():
+    """进程的内存峰值(MB), 不支持时返回None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS为字节, linux为KB
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def run_stages(excel_dir, export_dir, filter_string='', jobs=1, columnar=False, export_formats=None, trace_memory=False):
+    """按parse的顺序执行每个阶段
+
+    Returns:
+        list of (stage, seconds, peak_mb, error) peak_mb是trace_memory时该阶段Python对象的内存峰值
+    """
+    export_formats = export_formats or [excel2json.FORMAT_JSON]
+    state = {}
+
+    def read():
+        state['info_dict'] = excel2json.get_excels_info_dict(excel_dir, [''], jobs, filter_string=filter_string)
+
+    def set_columnar():
+        for sheet_info in state['info_dict'].values():
+            if sheet_info.con_type == excel2json.CON_LIST or sheet_info.con_type == excel2json.CON_DICT:
+                sheet_info.layout = excel2json.LAYOUT_COLUMNAR
+
+    def export(export_format):
+        def func():
+            data, meta = excel2json.assemble_export(state['info_dict'])
+            schemas = excel2json.get_row_schemas(state['info_dict'])
+            excel2json.export_files(data, meta, export_dir, 'config.json', 3, [export_format], schemas=schemas)
+        return func
+
+    stages = [('get_excels_info_dict', read)]
+    if columnar:
+        stages.append(('columnar', set_columnar))
+    stages.append(('assemble_foreign_item', lambda: excel2json.assemble_foreign_item(state['info_dict'])))
+    stages.append(('merge_array_item_fields', lambda: excel2json.merge_array_item_fields(state['info_dict'])))
+    stages.append(('assemble_simple_array_sheet', lambda: excel2json.assemble_simple_array_sheet(state['info_dict'])))
+    stages.append(('assemble_export', lambda: excel2json.assemble_export(state['info_dict'])))
+    for export_format in export_formats:
+        stages.append(('serialize_' + export_format, export(export_format)))
+
+    results = []
+    for name, func in stages:
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        error = None
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            error = '{0}: {1}'.format(type(e).__name__, e)
+        cost = time.perf_counter() - start
+        peak_mb = None
+        if trace_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            tracemalloc.stop()
+        results.append((name, cost, peak_mb, error))
+        if error and name == 'get_excels_info_dict':
+            break
+    return results
+
+
+def get_dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+
+
+def benchmark(excel_dir, filter_string='', jobs=1, columnar=False, export_formats=None, repeat=1, trace_memory=False):
+    """执行repeat次, 每个阶段取中位数(time)和最短时间(min)。trace_memory时再执行一次统计内存, 不影响计时
+
+    Returns:
+        dict
+    """
+    stages = {}
+    times = {}
+    export_dir = tempfile.mkdtemp(prefix='excel2json_bench_')
+    try:
+        with open(os.devnull, mode='w') as devnull:
+            for i in range(repeat + (1 if trace_memory else 0)):
+                traced = i == repeat
+                stdout = sys.stdout
+                # 不输出export信息
+                sys.stdout = devnull
+                try:
+                    results = run_stages(excel_dir, export_dir, filter_string, jobs, columnar, export_formats, traced)
+                finally:
+                    sys.stdout = stdout
+                for name, cost, peak_mb, error in results:
+                    if traced:
+                        if name in stages:
+                            stages[name]['peak_mb'] = round(peak_mb, 3)
+                        continue
+                    stage = stages.setdefault(name, {})
+                    times.setdefault(name, []).append(cost)
+                    if error:
+                        stage['error'] = error
+        output_bytes = get_dir_size(export_dir)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+    for name, stage in stages.items():
+        # 中位数不受个别慢的一次影响, 比较时使用
+        stage['time'] = round(statistics.median(times[name]), 6)
+        stage['min'] = round(min(times[name]), 6)
+    return {
+        'stages': stages,
+        'total': round(sum(x['time'] for x in stages.values()), 6),
+        'rss_mb': get_rss_mb(),
+        'output_bytes': output_bytes,
+    }
+
+
+def compare(result, baseline, threshold, min_seconds=0.05):
+    """与baseline比较每个阶段耗时的中位数
+
+    Args:
+        threshold:float 慢多少比例算作变慢, 0.2即20%
+        min_seconds:float 耗时差小于这个值时忽略(计时误差), 短的阶段即使比例超过threshold也不算变慢
+
+    Returns:
+        list 变慢的阶段
+    """
+    regressions = []
+    rows = []
+    base_stages = baseline.get('stages', {})
+    for name, stage in list(result['stages'].items()) + [('total', {'time': result['total']})]:
+        base = base_stages.get(name) if name != 'total' else {'time': baseline.get('total')}
+        if not base or base.get('time') is None:
+            rows.append((name, None, stage['time'], ''))
+            continue
+        ratio = stage['time'] / base['time'] if base['time'] else 0
+        mark = ''
+        if stage['time'] > base['time'] * (1 + threshold) and stage['time'] - base['time'] > min_seconds:
+            mark = 'REGRESSION'
+            regressions.append(name)
+        rows.append((name, base['time'], stage['time'], '{0:.2f}x {1}'.format(ratio, mark)))
+
+    print('{0:<30}{1:>12}{2:>12}  {3}'.format('stage', 'baseline', 'current', ''))
+    for name, base_time, cur_time, text in rows:
+        print('{0:<30}{1:>12}{2:>12.4f}  {3}'.format(name, '-' if base_time is None else '{0:.4f}'.format(base_time), cur_time, text))
+    return regressions
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--excel_dir', default=None, help='Benchmark an existing excel directory instead of generated workbooks')
+    args.add_argument('--out_dir', default=None, help='Directory for generated workbooks, a temporary directory by default')
+    args.add_argument('--rows', default=1000, type=int, help='Rows of the main sheet and the dict sheet')
+    args.add_argument('--cols', default=8, type=int, help='Basic value columns of the main sheet')
+    args.add_argument('--fanout', default=4, type=int, help='Foreign rows referenced by each main row')
+    args.add_argument('--arrays', default=3, type=int, help='arr_N columns merged into one array field')
+    args.add_argument('--matrix', default=100, type=int, help='Rows and columns of the matrix sheets')
+    args.add_argument('--density', default=0.05, type=float, help='Non-zero ratio of the sparse matrix')
+    args.add_argument('--format', default='xls', help='xls/xlsx')
+    args.add_argument('--seed', default=1, type=int)
+    args.add_argument('--filter', default='', help='Filter string, filtered columns are skipped while reading. "c,s"')
+    args.add_argument('--jobs', default=1, type=int)
+    args.add_argument('--columnar', action='store_true')
+    args.add_argument('--export_format', default=excel2json.FORMAT_JSON, help='"json,bin"')
+    args.add_argument('--repeat', default=5, type=int, help='Run every stage n times and compare the median')
+    args.add_argument('--trace_memory', action='store_true', help='Record peak python memory of each stage (slower)')
+    args.add_argument('--output', default=None, help='Write results to a json file')
+    args.add_argument('--baseline', default=None, help='Compare with a saved result')
+    args.add_argument('--threshold', default=0.2, type=float, help='Slowdown ratio treated as a regression')
+    args.add_argument('--min_delta', default=0.05, type=float, help='Ignore slowdowns smaller than this many seconds')
+    arg = args.parse_args()
+
+    config = {
+        'rows': arg.rows, 'cols': arg.cols, 'fanout': arg.fanout, 'arrays': arg.arrays,
+        'matrix': arg.matrix, 'density': arg.density, 'format': arg.format, 'seed': arg.seed,
+        'filter': arg.filter, 'jobs': arg.jobs, 'columnar': arg.columnar,
+        'export_format': arg.export_format, 'repeat': arg.repeat,
+    }
+
+    excel_dir = arg.excel_dir
+    tmp_dir = None
+    if excel_dir:
+        config = {'excel_dir': excel_dir, 'filter': arg.filter, 'jobs': arg.jobs, 'columnar': arg.columnar,
+                  'export_format': arg.export_format, 'repeat': arg.repeat}
+    else:
+        excel_dir = arg.out_dir
+        if not excel_dir:
+            excel_dir = tmp_dir = tempfile.mkdtemp(prefix='excel2json_bench_in_')
+        start = time.perf_counter()
+        generate_workbooks(excel_dir, arg.rows, arg.cols, arg.fanout, arg.arrays, arg.matrix, arg.density, arg.format, arg.seed)
+        print('generate {0} {1:.2f}s'.format(excel_dir, time.perf_counter() - start))
+
+    try:
+        result = benchmark(excel_dir, arg.filter, arg.jobs, arg.columnar, arg.export_format.split(','), arg.repeat, arg.trace_memory)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result['config'] = config
+    result['version'] = excel2json.VERSION
+    result['python'] = platform.python_version()
+    result['platform'] = platform.platform()
+    result['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    for name, stage in result['stages'].items():
+        text = '{0:<30}{1:>10.4f}s'.format(name, stage['time'])
+        if 'peak_mb' in stage:
+            text += '{0:>10.2f}MB'.format(stage['peak_mb'])
+        if 'error' in stage:
+            text += '  Error:' + stage['error']
+        print(text)
+    print('{0:<30}{1:>10.4f}s  rss {2}MB  output {3} bytes'.format('total', result['total'], result['rss_mb'], result['output_bytes']))
+
+    regressions = []
+    if arg.baseline:
+        with open(arg.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print('Warning:baseline config is different {0}'.format(baseline.get('config')))
+        regressions = compare(result, baseline, arg.threshold, arg.min_delta)
+
+    if arg.output:
+        with open(arg.output, mode='w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=True)
+
+    if regressions:
+        print('Error:regression in {0}'.format(','.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
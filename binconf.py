@@ -0,0 +1,393 @@
+"""二进制配置格式, excel2json.py --export_format=bin 导出
+
+文件结构(小端):
+    magic       b'E2CB'
+    version     1 byte
+    strings     varint count, uint_array byte_lens, utf-8 bytes
+    shapes      varint count, (varint key_count, varint string_index * key_count) * count
+    root        value
+
+value = tag(1 byte) + payload
+    NULL/FALSE/TRUE     无payload
+    INT                 zigzag varint
+    FLOAT               8 bytes double
+    STRING              varint string_index
+    LIST                varint count, value * count
+    OBJECT              varint shape_index, value * key_count
+    INT_ARRAY           varint count, byte signed, (signed ? zigzag varint : varint) * count
+    STRING_ARRAY        varint count, uint_array string_index
+    TABLE               varint shape_index, varint row_count, value * key_count
+
+uint_array = varint * count, 全部小于128时每个值正好1个字节, 解码时直接批量读取。
+对象的key列表(shape)只保存一次, 同结构的行只记录shape下标。
+key相同的对象列表(list/dict表的行)按列保存为TABLE, 每列是一个值(通常是INT_ARRAY/STRING_ARRAY)。
+字典key与JSON一致转换为字符串, loads的结果等于json.loads的结果。
+"""
+import sys
+import json
+import json.scanner
+import json.decoder
+import time
+import struct
+
+
+MAGIC = b'E2CB'
+VERSION = 1
+
+TAG_NULL = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STRING = 5
+TAG_LIST = 6
+TAG_OBJECT = 7
+TAG_INT_ARRAY = 8
+TAG_STRING_ARRAY = 9
+TAG_TABLE = 10
+
+_double = struct.Struct('<d')
+
+
+def json_key(k):
+    """dict的key按照json的规则转换为字符串"""
+    if type(k) == str:
+        return k
+    return next(iter(json.loads(json.dumps({k: 0}))))
+
+
+class Encoder:
+    def __init__(self):
+        self.strings = {}
+        self.shapes = {}
+
+    def string_index(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = len(self.strings)
+            self.strings[text] = index
+        return index
+
+    def shape_index(self, keys):
+        index = self.shapes.get(keys)
+        if index is None:
+            index = len(self.shapes)
+            self.shapes[keys] = index
+        return index
+
+    def encode(self, obj):
+        """编码为二进制
+
+        Args:
+            obj:list/dict/int/float/bool/str
+
+        Returns:
+            bytes
+        """
+        body = bytearray()
+        self.write_value(body, obj)
+
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        write_varint(out, len(self.strings))
+        blobs = [text.encode('utf-8') for text in self.strings]
+        for b in blobs:
+            write_varint(out, len(b))
+        for b in blobs:
+            out += b
+        write_varint(out, len(self.shapes))
+        for keys in self.shapes:
+            write_varint(out, len(keys))
+            for k in keys:
+                write_varint(out, self.string_index(k))
+        out += body
+        return bytes(out)
+
+    def write_value(self, out, o):
+        t = type(o)
+        if o is None:
+            out.append(TAG_NULL)
+        elif t == bool:
+            out.append(TAG_TRUE if o else TAG_FALSE)
+        elif t == int:
+            out.append(TAG_INT)
+            write_varint(out, zigzag(o))
+        elif t == float:
+            out.append(TAG_FLOAT)
+            out += _double.pack(o)
+        elif t == str:
+            out.append(TAG_STRING)
+            write_varint(out, self.string_index(o))
+        elif t == list or t == tuple:
+            if o and all(type(x) == int for x in o):
+                out.append(TAG_INT_ARRAY)
+                write_varint(out, len(o))
+                self.write_int_array(out, o)
+            elif o and all(type(x) == str for x in o):
+                out.append(TAG_STRING_ARRAY)
+                write_varint(out, len(o))
+                string_index = self.string_index
+                for x in o:
+                    write_varint(out, string_index(x))
+            elif len(o) > 1 and all(type(x) == dict for x in o) and self.is_table(o):
+                keys = tuple(json_key(k) for k in o[0])
+                for k in keys:
+                    self.string_index(k)
+                out.append(TAG_TABLE)
+                write_varint(out, self.shape_index(keys))
+                write_varint(out, len(o))
+                for column in zip(*[x.values() for x in o]):
+                    self.write_value(out, list(column))
+            else:
+                out.append(TAG_LIST)
+                write_varint(out, len(o))
+                for x in o:
+                    self.write_value(out, x)
+        elif t == dict:
+            keys = tuple(json_key(k) for k in o)
+            # 先登记key字符串, 保证字符串表的顺序稳定
+            for k in keys:
+                self.string_index(k)
+            out.append(TAG_OBJECT)
+            write_varint(out, self.shape_index(keys))
+            for v in o.values():
+                self.write_value(out, v)
+        else:
+            raise Exception('{0} is not supported by binconf'.format(t))
+
+    def is_table(self, rows):
+        keys = list(rows[0])
+        if not keys:
+            return False
+        for x in rows:
+            if list(x) != keys:
+                return False
+        return True
+
+    def write_int_array(self, out, lst):
+        signed = min(lst) < 0
+        out.append(1 if signed else 0)
+        if signed:
+            for x in lst:
+                write_varint(out, zigzag(x))
+        else:
+            for x in lst:
+                write_varint(out, x)
+
+
+def zigzag(n):
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+
+def write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def dumps(obj):
+    """编码为二进制
+
+    Args:
+        obj
+
+    Returns:
+        bytes
+    """
+    return Encoder().encode(obj)
+
+
+def dump(obj, filepath):
+    with open(filepath, mode='wb') as f:
+        f.write(dumps(obj))
+
+
+class Decoder:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.strings = []
+        self.shapes = []
+
+    def read_varint(self):
+        buf = self.buf
+        pos = self.pos
+        b = buf[pos]
+        pos += 1
+        if b < 0x80:
+            self.pos = pos
+            return b
+        n = b & 0x7f
+        shift = 7
+        while True:
+            b = buf[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                self.pos = pos
+                return n
+            shift += 7
+
+    def read_uint_array(self, count):
+        buf = self.buf
+        pos = self.pos
+        chunk = bytes(buf[pos:pos+count])
+        if chunk.isascii():
+            # 全部小于128, 每个varint正好1个字节
+            self.pos = pos + count
+            return list(chunk)
+        lst = []
+        append = lst.append
+        for i in range(count):
+            b = buf[pos]
+            pos += 1
+            if b < 0x80:
+                append(b)
+                continue
+            n = b & 0x7f
+            shift = 7
+            while True:
+                b = buf[pos]
+                pos += 1
+                n |= (b & 0x7f) << shift
+                if b < 0x80:
+                    break
+                shift += 7
+            append(n)
+        self.pos = pos
+        return lst
+
+    def read_zigzag(self):
+        n = self.read_varint()
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+    def decode(self):
+        buf = self.buf
+        if bytes(buf[0:4]) != MAGIC:
+            raise Exception('not a binconf file')
+        if buf[4] != VERSION:
+            raise Exception('binconf version {0} is not supported'.format(buf[4]))
+        self.pos = 5
+
+        count = self.read_varint()
+        byte_lens = self.read_uint_array(count)
+        pos = self.pos
+        for n in byte_lens:
+            self.strings.append(str(buf[pos:pos+n], 'utf-8'))
+            pos += n
+        self.pos = pos
+
+        count = self.read_varint()
+        for i in range(count):
+            n = self.read_varint()
+            self.shapes.append([self.strings[self.read_varint()] for j in range(n)])
+
+        return self.read_value()
+
+    def read_value(self):
+        tag = self.buf[self.pos]
+        self.pos += 1
+        if tag == TAG_INT:
+            return self.read_zigzag()
+        if tag == TAG_STRING:
+            return self.strings[self.read_varint()]
+        if tag == TAG_OBJECT:
+            keys = self.shapes[self.read_varint()]
+            read_value = self.read_value
+            return {k: read_value() for k in keys}
+        if tag == TAG_TABLE:
+            keys = self.shapes[self.read_varint()]
+            self.read_varint()
+            read_value = self.read_value
+            columns = [read_value() for k in keys]
+            return [dict(zip(keys, row)) for row in zip(*columns)]
+        if tag == TAG_INT_ARRAY:
+            n = self.read_varint()
+            signed = self.buf[self.pos]
+            self.pos += 1
+            lst = self.read_uint_array(n)
+            if signed:
+                return [(x >> 1) ^ -(x & 1) for x in lst]
+            return lst
+        if tag == TAG_STRING_ARRAY:
+            n = self.read_varint()
+            return list(map(self.strings.__getitem__, self.read_uint_array(n)))
+        if tag == TAG_LIST:
+            n = self.read_varint()
+            read_value = self.read_value
+            return [read_value() for i in range(n)]
+        if tag == TAG_FLOAT:
+            v = _double.unpack_from(self.buf, self.pos)[0]
+            self.pos += 8
+            return v
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_NULL:
+            return None
+        raise Exception('unknown tag {0} at {1}'.format(tag, self.pos - 1))
+
+
+def loads(buf):
+    """解码二进制配置
+
+    Args:
+        buf:bytes
+
+    Returns:
+        与json.loads(导出的JSON)相同的数据
+    """
+    return Decoder(memoryview(buf)).decode()
+
+
+def load(filepath):
+    with open(filepath, mode='rb') as f:
+        return loads(f.read())
+
+
+def benchmark(bin_filepath, json_filepath, repeat=5):
+    """比较同一份数据二进制和JSON的大小和解码时间"""
+    with open(bin_filepath, mode='rb') as f:
+        bin_bytes = f.read()
+    with open(json_filepath, mode='rb') as f:
+        json_bytes = f.read()
+
+    def best(func, arg):
+        t = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = func(arg)
+            cost = time.perf_counter() - start
+            t = cost if t is None else min(t, cost)
+        return result, t
+
+    bin_data, bin_time = best(loads, bin_bytes)
+    json_data, json_time = best(json.loads, json_bytes)
+    if bin_data != json_data:
+        print('Error:binary data is different from json data')
+    print('json {0} bytes, decode {1:.4f}s (json.loads)'.format(len(json_bytes), json_time))
+    print('bin  {0} bytes, decode {1:.4f}s (binconf.loads)'.format(len(bin_bytes), bin_time))
+    print('size {0:.2f}x smaller, decode {1:.2f}x {2} than json.loads'.format(
+        len(json_bytes) / len(bin_bytes), max(json_time, bin_time) / min(json_time, bin_time),
+        'faster' if bin_time < json_time else 'slower'))
+
+    # json.loads是C实现, 这里的loads是纯python, 所以解码比json.loads慢(格式本身的目标是更小、原生实现时解码更快);
+    # 下面的比较两边都是纯python, 客户端的两种解码器实现方式相同时才可以参考
+    # py_make_scanner创建时取出parse_string, JSONObject解析key时使用模块中的scanstring, 都要先替换为python实现
+    py_decoder = json.JSONDecoder()
+    py_decoder.parse_string = json.decoder.py_scanstring
+    py_decoder.scan_once = json.scanner.py_make_scanner(py_decoder)
+    scanstring = json.decoder.scanstring
+    json.decoder.scanstring = json.decoder.py_scanstring
+    try:
+        py_json_data, py_json_time = best(py_decoder.decode, json_bytes.decode('utf-8'))
+    finally:
+        json.decoder.scanstring = scanstring
+    print('pure python json decode {0:.4f}s, {1:.2f}x of binconf.loads'.format(py_json_time, py_json_time / bin_time))
+
+
+if __name__ == '__main__':
+    # python binconf.py config.bin config.json
+    benchmark(sys.argv[1], sys.argv[2])
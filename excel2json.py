@@ -1,10 +1,27 @@
 from sys import flags
 import os
+import sys
 import re
 import json
 import xlrd
+import binconf
+import xlsxreader
 import logging
+import pickle
+import pprint
+import time
+import hashlib
+import math
+import zlib
+import lzma
 import argparse
+import cProfile
+import contextlib
+import tracemalloc
+from array import array
+from functools import partial
+from itertools import accumulate, chain, compress, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 # excel field value type
@@ -14,12 +31,58 @@ DOUBLE = "double"
 BOOL = "bool"
 STRING = "string"
 
+VERSION = '1.7.1'
+
+# parse cache, saved in the user's cache directory (never in excel_dir), one file per excel_dir
+CACHE_DIRNAME = 'excel2json'
+# saved in export_dir, not shipped to clients (see README)
+MANIFEST_FILENAME = '.excel2json.manifest'
+# --patch_dir
+SNAPSHOT_FILENAME = '.excel2json.snapshot'
+PATCH_CHAIN_FILENAME = 'patches.json'
+
+# export format
+FORMAT_JSON = 'json'
+FORMAT_BIN = 'bin'
+
+# compressed copies of exported files
+COMPRESS_GZIP = 'gzip'
+COMPRESS_LZMA = 'lzma'
+COMPRESS_EXTENSIONS = {COMPRESS_GZIP: '.gz', COMPRESS_LZMA: '.xz'}
+# 原始数据攒够这么多字节再交给压缩线程
+COMPRESS_BATCH_SIZE = 1 << 20
+
+# --shard_by 按行数或主键范围拆分大表
+SHARD_BY_ROWS = 'rows'
+SHARD_BY_KEY = 'key'
+
+# validation
+# 导出格式都不限制int的位数(JSON、binconf的varint), 只检查64位整数的范围
+INT_RANGE = (-2**63, 2**63 - 1)
+FLOAT_MAX = 3.4028234663852886e+38
+ERROR_CELL_TYPE = 'cell_type'
+ERROR_OUT_OF_RANGE = 'out_of_range'
+ERROR_DUPLICATE_KEY = 'duplicate_key'
+ERROR_FOREIGN_KEY = 'foreign_key'
+
 # data container
 CON_LIST = 'list'
 CON_DICT = 'dict'
 CON_OBJECT = 'object'
 CON_MATRIX = 'matrix'
 CON_MATRIX_CSR = 'matrix(csr)'
+CON_MATRIX_CSR_STD = 'matrix(csr_std)'
+CON_MATRIX_COO = 'matrix(coo)'
+CON_MATRIX_TYPES = (CON_MATRIX, CON_MATRIX_CSR, CON_MATRIX_CSR_STD, CON_MATRIX_COO)
+CON_TYPES = (CON_LIST, CON_DICT, CON_OBJECT) + CON_MATRIX_TYPES
+
+# list/dict数据开始的行下标(第6行)
+LIST_START_ROW = 5
+
+# list/dict data layout
+LAYOUT_ROWS = 'rows'
+LAYOUT_COLUMNAR = 'columnar'
+LAYOUT_POOL = 'pool'
 
 
 class ExcelSheetInfo:
@@ -29,7 +92,82 @@ class ExcelSheetInfo:
         self.con_type = ''
         self.data = None
         self.fields = []
-        
+        self.layout = LAYOUT_ROWS
+        # 校验错误 list of {type, row, field, value, message}
+        self.errors = []
+
+    def add_error(self, error_type, message, row=None, field=None, value=None):
+        """记录校验错误
+
+        Args:
+            error_type:str ERROR_*
+            message:str
+            row:int Excel中的行号(从1开始)
+            field:str
+            value: 单元格的值
+        """
+        self.errors.append({'type': error_type, 'row': row, 'field': field, 'value': value, 'message': message})
+
+    def get_field_index(self, name):
+        """字段在ExcelTable.columns中的下标, 没有该字段时返回-1"""
+        for i, f in enumerate(self.fields):
+            if f.name == name:
+                return i
+        return -1
+
+
+class ExcelTable:
+    """list/dict表的数据, 按sheet_info.fields的顺序按列保存, 导出时才转换为每行一个dict(见RowSchemas)
+
+    每列是一个list, 全部是int或全部是float的列压缩为array或ListColumn(见compact_column);
+    外链之后外键列是ForeignColumn, 合并的外键数组列是ArrayColumn, 外表的行只保存行号
+    """
+    def __init__(self, columns, count):
+        self.columns = columns
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+
+class ListColumn:
+    """元素全部是int或全部是float的数组列(如int[]), 所有行的元素连续保存在一个array中
+
+    第i行的值是values[offsets[i]:offsets[i+1]], 取出时转换为list
+    """
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __getitem__(self, i):
+        return list(self.values[self.offsets[i]:self.offsets[i + 1]])
+
+
+class ForeignColumn:
+    """外链之后的外键列, 第i行的结果是外表的行号indexes[offsets[i]:offsets[i+1]]
+
+    没有结果(条件为空或者没有找到外链对象)的行values[i]是原来的值, 有结果的行values[i]为None
+    """
+    def __init__(self, sheet_name, result_type, values, offsets, indexes):
+        self.sheet_name = sheet_name
+        self.result_type = result_type
+        self.values = values
+        self.offsets = offsets
+        self.indexes = indexes
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+class ArrayColumn:
+    """元素是外键的数组字段(ids_0..ids_N)合并成的列, 第i行的值是每个元素列第i行的值的list"""
+    def __init__(self, sheet_name, items):
+        # 元素引用的外表, 元素不是外键时为None
+        self.sheet_name = sheet_name
+        self.items = items
+
+    def __getitem__(self, i):
+        return [x[i] for x in self.items]
 
 
 class ExcelFieldInfo:
@@ -38,6 +176,8 @@ class ExcelFieldInfo:
         self.type = type
         self.index = index
         self.filter = filter
+        # ids_0..ids_N合并成的数组字段, 每个元素对应的字段(list of ExcelFieldInfo)
+        self.items = None
 
         self.foreign_key = None
         if self.is_foreign_key(type):
@@ -63,6 +203,93 @@ class ExcelForeignKey:
         self.keys = arr[1].split(',')
 
 
+class Profiler:
+    """--profile 按表格文件、sheet和阶段记录耗时、行数、单元格数量和内存峰值
+
+    阶段: open header rows foreign array_merge assemble shard dump loader
+    dump/loader阶段的workbook为导出的文件名。内存由tracemalloc统计, peak_mb为阶段内超出开始时的内存峰值。
+    """
+    def __init__(self, trace_memory=True):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.peaks = []
+        self.start_time = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def measure(self, stage, workbook='', sheet=''):
+        record = {'stage': stage, 'workbook': workbook, 'sheet': sheet, 'time': 0, 'rows': 0, 'cells': 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - start
+            if self.trace_memory:
+                end, peak = tracemalloc.get_traced_memory()
+                peak = max(self.peaks.pop(), peak)
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+                record['peak_mb'] = (peak - current) / 1048576.0
+                record['alloc_mb'] = (end - current) / 1048576.0
+            self.records.append(record)
+
+    def group(self, get_key):
+        groups = {}
+        for r in self.records:
+            key = get_key(r)
+            if not key:
+                continue
+            g = groups.setdefault(key, {'time': 0, 'rows': 0, 'cells': 0, 'count': 0})
+            g['time'] += r['time']
+            g['rows'] += r['rows']
+            g['cells'] += r['cells']
+            g['count'] += 1
+            if 'peak_mb' in r:
+                g['peak_mb'] = max(g.get('peak_mb', 0), r['peak_mb'])
+        return dict(sorted(groups.items(), key=lambda x: -x[1]['time']))
+
+    def report(self):
+        """Returns:
+            dict {total, stages, workbooks, sheets, records}
+        """
+        return {
+            'total': time.perf_counter() - self.start_time,
+            'stages': self.group(lambda r: r['stage']),
+            'workbooks': self.group(lambda r: r['workbook']),
+            'sheets': self.group(lambda r: '{0}.{1}'.format(r['workbook'], r['sheet']) if r['sheet'] else ''),
+            'records': self.records,
+        }
+
+    def dump(self, filepath, top=10):
+        """保存JSON报告并打印耗时最多的阶段"""
+        report = self.report()
+        with open(filepath, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=True)
+
+        print('profile {0:.3f}s => {1}'.format(report['total'], filepath))
+        for name in ('stages', 'workbooks'):
+            print('{0}: {1}'.format(name, ' '.join('{0}={1:.3f}s'.format(k, v['time']) for k, v in list(report[name].items())[:top])))
+        print('{0:>9} {1:<12} {2:<40} {3:>8} {4:>10} {5:>9}'.format('time', 'stage', 'sheet', 'rows', 'cells', 'peak_mb'))
+        for r in sorted(self.records, key=lambda x: -x['time'])[:top]:
+            print('{0:>8.3f}s {1:<12} {2:<40} {3:>8} {4:>10} {5:>9}'.format(
+                r['time'], r['stage'], '.'.join(x for x in (r['workbook'], r['sheet']) if x),
+                r['rows'], r['cells'], '{0:.2f}'.format(r['peak_mb']) if 'peak_mb' in r else '-'))
+
+
+def profile_stage(profiler, stage, workbook='', sheet=''):
+    """profiler为None时不记录"""
+    if profiler is None:
+        return contextlib.nullcontext({})
+    return profiler.measure(stage, workbook, sheet)
+
+
 def get_lang_type(text):
     """convert string to python type.
 
@@ -131,6 +358,8 @@ def change_type(o, t):
             f = float(o)
         except:
             f = 0
+        if not math.isfinite(f):
+            return f
         int_f = int(f)
         return int_f if int_f == f else f
     if t == bool:
@@ -209,7 +438,169 @@ def parse_basic_value_array(text, element_type, split_string):
         return [change_type(x.strip(), element_type) for x in text.split(split_string)]
 
 
-def parse_excel_list(sh, info):
+def get_value_converter(field_type, strict=False):
+    """根据字段类型生成单元格转换函数, 结果与change_type/parse_basic_value_array一致
+
+    Args:
+        field_type:str
+        strict:bool 无法转换的单元格抛出ValueError, 而不是转换为0
+
+    Returns:
+        function(cell_value) => value
+    """
+    if is_basic_value_type(field_type):
+        py_type = get_lang_type(field_type)
+        if py_type == int:
+            def convert(o):
+                if type(o) is int:
+                    return o
+                if o == '':
+                    return 0
+                try:
+                    f = float(o)
+                    if strict and not f.is_integer():
+                        raise ValueError(o)
+                    return int(f)
+                except:
+                    if strict:
+                        raise ValueError(o)
+                    return 0
+        elif py_type == float and strict:
+            def convert(o):
+                if type(o) is float:
+                    return o
+                if o == '' or o is None:
+                    return 0
+                try:
+                    f = float(o)
+                except:
+                    raise ValueError(o)
+                if not math.isfinite(f):
+                    return f
+                int_f = int(f)
+                return int_f if int_f == f else f
+        elif py_type == str:
+            # 字符串驻留, 相同的文本在所有表中只保存一份
+            def convert(o):
+                return sys.intern(o if type(o) is str else change_type(o, str))
+        else:
+            def convert(o):
+                if type(o) is py_type:
+                    return o
+                return change_type(o, py_type)
+    elif is_basic_value_array(field_type):
+        idx = field_type.index('[]')
+        convert_item = get_value_converter(field_type[:idx], strict)
+        split_string = field_type[idx+2:]
+        if not split_string:
+            split_string = ','
+        # 同一列中重复的数组文本只解析一次
+        memo = {}
+        def convert(o):
+            text = str(o)
+            if not text:
+                return []
+            lst = memo.get(text)
+            if lst is None:
+                lst = [convert_item(x.strip()) for x in text.split(split_string)]
+                memo[text] = lst
+            return list(lst)
+    else:
+        # query type
+        def convert(o):
+            return str(o).split(',')
+    return convert
+
+
+def get_column_converter(field_type):
+    """根据字段类型生成整列转换函数, 表头解析时生成一次
+
+    整列都是数字(或都是字符串)时用内置函数批量转换, 否则逐个单元格转换。
+    传入errors时同时检查转换结果, 无法转换的单元格(按原来的规则转换为0)和超出范围的值
+    以(下标, 单元格的值, 错误类型)加入errors, 只在转换失败或者min/max超出范围时才逐个检查
+
+    Args:
+        field_type:str
+
+    Returns:
+        function(list, errors=None) => list
+    """
+    convert = get_value_converter(field_type)
+    convert_strict = get_value_converter(field_type, True)
+    check_range = get_range_checker(field_type)
+    py_type = get_lang_type(field_type)
+    if py_type == int:
+        # float.__int__ 遇到非float单元格会抛出TypeError
+        bulk = float.__int__
+    elif py_type == float:
+        bulk = float.__float__
+    elif py_type == str:
+        bulk = str
+    elif py_type == bool:
+        bulk = bool
+    else:
+        bulk = None
+
+    def convert_column(values, errors=None):
+        column = None
+        if bulk:
+            try:
+                column = list(map(bulk, values))
+            except (TypeError, ValueError, OverflowError):
+                pass
+            if column is not None and py_type == str:
+                column = list(map(sys.intern, column))
+        if errors is None:
+            return column if column is not None else [convert(x) for x in values]
+
+        if column is None:
+            try:
+                column = [convert_strict(x) for x in values]
+            except (TypeError, ValueError, OverflowError):
+                column = []
+                for i, x in enumerate(values):
+                    try:
+                        column.append(convert_strict(x))
+                    except (TypeError, ValueError, OverflowError):
+                        errors.append((i, x, ERROR_CELL_TYPE))
+                        column.append(convert(x))
+        elif py_type == int and not all(map(float.is_integer, values)):
+            # 小数被截断
+            errors.extend((i, x, ERROR_CELL_TYPE) for i, x in enumerate(values) if not x.is_integer())
+        if check_range:
+            errors.extend((i, values[i], ERROR_OUT_OF_RANGE) for i in check_range(column))
+        return column
+    return convert_column
+
+
+def get_range_checker(field_type):
+    """int字段的范围为int64, float字段为float32, double字段不能是inf/nan
+
+    Returns:
+        function(column) => 超出范围的下标列表, 非数字字段返回None
+    """
+    if field_type == INT:
+        lo, hi = INT_RANGE
+    elif field_type == FLOAT:
+        lo, hi = -FLOAT_MAX, FLOAT_MAX
+    elif field_type == DOUBLE:
+        lo, hi = -math.inf, math.inf
+    else:
+        return None
+
+    def check_range(column):
+        if not column:
+            return []
+        # nan与任何数比较都是False, min/max不可靠, 先用isfinite排除
+        if field_type != INT and not all(map(math.isfinite, column)):
+            return [i for i, x in enumerate(column) if not math.isfinite(x) or x < lo or x > hi]
+        if min(column) >= lo and max(column) <= hi:
+            return []
+        return [i for i, x in enumerate(column) if x < lo or x > hi]
+    return check_range
+
+
+def parse_excel_list(sh, info, profiler=None, filter_string=''):
     """Parse excel as a list structure
 
     | id   | name | age   |
@@ -219,12 +610,177 @@ def parse_excel_list(sh, info):
     | ID   | 名称  | 年纪  |
     | 1    | Jack | 10    |
     | 2    | Lucy | 20    |
+
+    被filter_string过滤的列不读取也不转换
     """
     fields = []
     info.fields = fields
-    start_at = 5
+    start_at = LIST_START_ROW
+
+    with profile_stage(profiler, 'header', info.filename, info.name):
+        parse_list_fields(sh, fields, filter_string)
+
+    with profile_stage(profiler, 'rows', info.filename, info.name) as record:
+        # 转换时同时校验, (行下标, 字段, 单元格的值, 错误类型)
+        errors = []
+        if isinstance(sh, xlsxreader.XlsxSheet):
+            info.data = convert_list_rows(sh.iter_rows(start_at), fields, errors=errors)
+        else:
+            # 转换函数不保存在field中, 保证ExcelSheetInfo可以pickle
+            columns = [compact_column(convert_list_field(field, lambda c: sh.col_values(c, start_at), errors))
+                       for field in fields]
+            info.data = ExcelTable(columns, len(columns[0]) if columns else max(sh.nrows - start_at, 0))
+
+        add_cell_errors(info, errors, start_at)
+        if info.con_type == CON_DICT and fields:
+            check_duplicate_keys(info, fields[0].name, info.data.columns[0], start_at)
+        record['rows'] = len(info.data)
+        record['cells'] = len(info.data) * len(fields)
+    return info
+
+
+def convert_list_column(field, values, errors, converter=None, offset=0):
+    """转换并校验一列
+
+    Args:
+        field:ExcelFieldInfo
+        values:list 单元格的值
+        errors:list 校验错误以(行下标, field, 单元格的值, 错误类型)加入
+        converter: get_column_converter(field.type)的结果, 为None时生成
+        offset:int 第一个单元格的行下标
+
+    Returns:
+        list
+    """
+    convert = converter or get_column_converter(field.type)
+    if errors is None:
+        return convert(values)
+    column_errors = []
+    column = convert(values, column_errors)
+    errors.extend((offset + i, field, value, error_type) for i, value, error_type in column_errors)
+    return column
+
 
-    for c in range(0, sh.ncols):
+def convert_list_field(field, get_values, errors, converters=None, offset=0):
+    """转换一个字段的整列, 数组字段(ids_0..ids_N)的每个元素分别按列转换后再组合成list
+
+    Args:
+        field:ExcelFieldInfo
+        get_values:function(列下标) => 单元格的值
+        errors:list 见convert_list_column
+        converters:dict 列下标 => get_column_converter的结果
+        offset:int
+
+    Returns:
+        list
+    """
+    if field.items is None:
+        return convert_list_column(field, get_values(field.index), errors, converters and converters[field.index], offset)
+    columns = [convert_list_column(item, get_values(item.index), errors, converters and converters[item.index], offset)
+               for item in field.items]
+    return list(map(list, zip(*columns)))
+
+
+def add_cell_errors(info, errors, start_at):
+    """把convert_list_column的校验错误记录到sheet"""
+    for i, field, value, error_type in errors:
+        if error_type == ERROR_CELL_TYPE:
+            message = '[{0}] is not {1}'.format(value, field.type)
+        else:
+            message = '[{0}] is out of the range of {1}'.format(value, field.type)
+        info.add_error(error_type, message, start_at + i + 1, field.name, value)
+
+
+def check_duplicate_keys(info, key_field_name, keys, start_at):
+    """dict表主键重复时导出只保留最后一行, 重复的主键记录为错误
+
+    Args:
+        info:ExcelSheetInfo
+        key_field_name:str
+        keys:list 每一行的主键
+        start_at:int 数据开始的行下标
+    """
+    try:
+        if len(set(keys)) == len(keys):
+            return
+    except TypeError:
+        # 数组主键不能建立索引
+        return
+    last_rows = {}
+    for i, key in enumerate(keys):
+        if key in last_rows:
+            message = 'duplicate primary key [{0}], row {1} is overwritten'.format(key, last_rows[key])
+            info.add_error(ERROR_DUPLICATE_KEY, message, start_at + i + 1, key_field_name, key)
+        last_rows[key] = start_at + i + 1
+
+
+def convert_list_rows(rows, fields, chunk_size=4096, errors=None):
+    """逐行读取的sheet(.xlsx)按块转换, 每块与整列读取时一样按列批量转换
+
+    Args:
+        rows:iterable of row list 行的长度可能不同
+        fields:list of ExcelFieldInfo
+        errors:list 传入时同时校验, 见convert_list_column
+
+    Returns:
+        ExcelTable
+    """
+    converters = {}
+    for field in fields:
+        for item in field.items or [field]:
+            converters[item.index] = get_column_converter(item.type)
+    columns = [[] for field in fields]
+    count = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return ExcelTable([compact_column(x) for x in columns], count)
+        get_values = lambda c: [row[c] if c < len(row) else '' for row in chunk]
+        for column, field in zip(columns, fields):
+            column.extend(convert_list_field(field, get_values, errors, converters, count))
+        count += len(chunk)
+
+
+def compact_column(column):
+    """全部是int(64位以内)或全部是float的列转换为array, 元素全部是int或全部是float的数组列转换为ListColumn,
+    其它列(包括bool和类型混合的列)仍然是list
+
+    array取出的值仍然是int/float, 导出的结果不变; 每个值只占8字节, 不再是单独的对象
+    """
+    types = set(map(type, column))
+    try:
+        if types == {int}:
+            return array('q', column)
+        if types == {float}:
+            return array('d', column)
+        if types == {list}:
+            item_types = set()
+            for x in column:
+                item_types.update(map(type, x))
+            if item_types == {int} or item_types == {float}:
+                offsets = array('q', [0])
+                offsets.extend(accumulate(map(len, column)))
+                return ListColumn(offsets, array('q' if item_types == {int} else 'd', chain.from_iterable(column)))
+    except OverflowError:
+        pass
+    return column
+
+
+def is_field_filtered(field_filter, filter_string):
+    """字段的过滤规则是否匹配--filter
+
+    Args:
+        field_filter:str 表头中字段的过滤规则
+        filter_string:str --filter "c,s"
+    """
+    return bool(field_filter) and field_filter in filter_string
+
+
+def parse_list_fields(sh, fields, filter_string=''):
+    """读取list/dict表的表头(字段名、类型、过滤规则), 被过滤的字段不加入fields"""
+    # 与ncols相同(xlrd每一行都补齐到ncols), .xlsx不需要读取整个sheet
+    for c in range(0, len(sh.row_values(1))):
         fieldname = sh.cell(1, c).value
         if not fieldname:
             continue
@@ -238,37 +794,55 @@ def parse_excel_list(sh, info):
             continue
         field_type_string = str(field_type_string).replace(' ', '')
 
-        mvalue = sh.cell(3, c).value
-        filter_string = filter_string = str(mvalue)
-        field = ExcelFieldInfo(fieldname, field_type_string, c, filter_string)
+        field_filter = str(sh.cell(3, c).value)
+        if is_field_filtered(field_filter, filter_string):
+            continue
+        field = ExcelFieldInfo(fieldname, field_type_string, c, field_filter)
         fields.append(field)
+    fields[:] = fold_array_fields(fields)
 
-    info.data = []
-    for r in range(start_at, sh.nrows):
-        obj = {}
-        info.data.append(obj)
-        for field in fields:
-            col = field.index
-            val = sh.cell(r, col).value
-            if is_basic_value_type(field.type):
-                py_type = get_lang_type(field.type)
-                val = change_type(val, py_type)
-            elif is_basic_value_array(field.type):
-                idx = field.type.index('[]')
-                py_type = get_lang_type(field.type[:1-idx])
-                split_string = field.type[idx+2:]
-                if not split_string:
-                    split_string = ','
-                val = parse_basic_value_array(str(val), py_type, split_string)
-            else:
-                # query type
-                val = str(val).split(',')
 
-            obj[field.name] = val
-    return info
+def get_array_item_name(field_name):
+    """ids_0 => ids, 不是数组元素时返回None"""
+    split_pos = field_name.rfind('_')
+    if split_pos > 0 and field_name[split_pos+1:].isnumeric():
+        return field_name[:split_pos]
+    return None
+
+
+def fold_array_fields(fields):
+    """读取表头时合并数组字段 ids_0:int,ids_1:int... => ids:int[]
 
+    已经有同名字段(ids)时不合并; 元素是外键时在外链之后由merge_array_item_fields合并。
+    合并后的字段按第一次出现的顺序放在最后, 元素按列的顺序排列。
 
-def parse_excel_object(sh, info):
+    Args:
+        fields:list of ExcelFieldInfo
+
+    Returns:
+        list of ExcelFieldInfo
+    """
+    names = set(f.name for f in fields)
+    groups = {}
+    for f in fields:
+        array_name = get_array_item_name(f.name)
+        if array_name and array_name not in names:
+            groups.setdefault(array_name, []).append(f)
+    for array_name in [k for k, items in groups.items() if any(x.foreign_key for x in items)]:
+        del groups[array_name]
+    if not groups:
+        return fields
+
+    folded = set(id(x) for items in groups.values() for x in items)
+    result = [f for f in fields if id(f) not in folded]
+    for array_name, items in groups.items():
+        field = ExcelFieldInfo(array_name, items[0].type + '[]', -1, items[0].filter)
+        field.items = items
+        result.append(field)
+    return result
+
+
+def parse_excel_object(sh, info, filter_string=''):
     """ Sheet name is 'object'.
     | id   | int  |     | ID   | 10    |
     | ---- | ---- | --- | ---- | ----- |
@@ -288,75 +862,167 @@ def parse_excel_object(sh, info):
         
         py_type = get_lang_type(field_type)
 
-        if field_name and py_type:
-            fields.append(ExcelFieldInfo(field_name, field_type, r, field_filter))
-            val = change_type(field_value, py_type)
-            obj[field_name] = val
+        if field_name and py_type and not is_field_filtered(field_filter, filter_string):
+            field = ExcelFieldInfo(field_name, field_type, r, field_filter)
+            fields.append(field)
+            obj[field_name] = change_type(field_value, py_type)
+            # 只用于校验, 值仍然按change_type转换
+            errors = []
+            convert_list_column(field, [field_value], errors)
+            add_cell_errors(info, errors, r)
+
+    info.fields = fold_array_fields(fields)
+    if len(info.fields) != len(fields):
+        info.data = {f.name: [obj[x.name] for x in f.items] if f.items else obj[f.name] for f in info.fields}
     
     return info
 
 
+def read_matrix_values(sh, errors=None):
+    """整行读取矩阵数值(去掉行头列头), 单元格按int转换
+
+    Args:
+        errors:list 传入时同时校验, 以(行下标, 列下标, 单元格的值, 错误类型)加入
+
+    Returns:
+        list of row list
+    """
+    convert = get_value_converter(INT)
+    convert_strict = get_value_converter(INT, True)
+    check_range = get_range_checker(INT)
+
+    def convert_cell(r, c, x):
+        if errors is None:
+            return convert(x)
+        try:
+            return convert_strict(x)
+        except ValueError:
+            errors.append((r, c + 1, x, ERROR_CELL_TYPE))
+            return convert(x)
+
+    mat_rows = []
+    for r in range(1, sh.nrows):
+        row = sh.row_values(r, 1)
+        n = len(row)
+        # 空单元格和0.0都是0, 稀疏行只转换非空单元格
+        cols = list(compress(range(n), row))
+        if len(cols)*2 < n:
+            int_row = [0] * n
+            for c in cols:
+                int_row[c] = convert_cell(r, c, row[c])
+        else:
+            values = [x or 0.0 for x in row]
+            try:
+                int_row = list(map(float.__int__, values))
+                if errors is not None and not all(map(float.is_integer, values)):
+                    errors.extend((r, c + 1, x, ERROR_CELL_TYPE) for c, x in enumerate(values) if not x.is_integer())
+            except (TypeError, ValueError, OverflowError):
+                int_row = [convert_cell(r, c, x) for c, x in enumerate(row)]
+        if errors is not None:
+            errors.extend((r, c + 1, row[c], ERROR_OUT_OF_RANGE) for c in check_range(int_row))
+        mat_rows.append(int_row)
+    return mat_rows
+
+
+def build_matrix_dense(mat_rows):
+    """按行展开的普通矩阵"""
+    return {"matrix": list(chain.from_iterable(mat_rows))}
+
+
+def build_matrix_csr(mat_rows):
+    """matrix(csr) 格式见README
+
+    [非空行数量, (行号, 该行第一个列号的下标) * 非空行数量, (列号, 值) * 非0值数量]
+    """
+    row_items = []
+    col_items = []
+    for r, row in enumerate(mat_rows):
+        cols = list(compress(range(len(row)), row))
+        if cols:
+            row_items.append(r)
+            row_items.append(len(col_items))
+            items = [0] * (len(cols) * 2)
+            items[0::2] = cols
+            items[1::2] = compress(row, row)
+            col_items.extend(items)
+
+    # 列数据的下标从 1 + 非空行数量*2 开始
+    row_count = len(row_items) // 2
+    offset = 1 + row_count*2
+    row_items[1::2] = [x + offset for x in row_items[1::2]]
+    return {"matrix": [row_count] + row_items + col_items}
+
+
+def build_matrix_csr_std(mat_rows):
+    """标准CSR: 第r行的列号为indices[indptr[r]:indptr[r+1]], 值为data中的相同区间"""
+    indptr = [0]
+    indices = []
+    data = []
+    for row in mat_rows:
+        indices.extend(compress(range(len(row)), row))
+        data.extend(compress(row, row))
+        indptr.append(len(data))
+    ncols = len(mat_rows[0]) if mat_rows else 0
+    return {"indptr": indptr, "indices": indices, "data": data, "shape": [len(mat_rows), ncols]}
+
+
+def build_matrix_coo(mat_rows):
+    """COO: 第i个非0值位于(row[i], col[i]), 值为data[i]"""
+    rows = []
+    cols = []
+    data = []
+    for r, row in enumerate(mat_rows):
+        data.extend(compress(row, row))
+        c = list(compress(range(len(row)), row))
+        cols.extend(c)
+        rows.extend([r] * len(c))
+    ncols = len(mat_rows[0]) if mat_rows else 0
+    return {"row": rows, "col": cols, "data": data, "shape": [len(mat_rows), ncols]}
+
+
 def parse_excel_mat(sh, info):
-    """Sheet name is matrix. CSR
+    """Sheet name is matrix/matrix(csr)/matrix(csr_std)/matrix(coo).
 
     | matrix |     |     |
     | ------ | --- | --- |
     |        | 11  | 12  |    
     |        | 21  | 22  |
     """
+    errors = []
+    mat_rows = read_matrix_values(sh, errors)
+    for r, c, value, error_type in errors:
+        if error_type == ERROR_CELL_TYPE:
+            message = 'cell({0},{1}) [{2}] is not int'.format(r, c, value)
+        else:
+            message = 'cell({0},{1}) [{2}] is out of the range of int'.format(r, c, value)
+        info.add_error(error_type, message, r + 1, None, value)
+
+    if info.con_type == CON_MATRIX_CSR_STD:
+        data_fields = ['indptr', 'indices', 'data', 'shape']
+        data = build_matrix_csr_std(mat_rows)
+    elif info.con_type == CON_MATRIX_COO:
+        data_fields = ['row', 'col', 'data', 'shape']
+        data = build_matrix_coo(mat_rows)
+    elif info.con_type == CON_MATRIX_CSR:
+        data_fields = ['matrix']
+        data = build_matrix_csr(mat_rows)
+    else:
+        data_fields = ['matrix']
+        data = build_matrix_dense(mat_rows)
 
-    pyt = int
     info.fields = [
         ExcelFieldInfo('type', sh.name, 0, ''),
         ExcelFieldInfo('row_head', 'int[]', 0, ''),
         ExcelFieldInfo('col_head', 'int[]', 1, ''),
-        ExcelFieldInfo('matrix', 'int[]', 2, '')
     ]
-    mat = []
-
-    if info.con_type == CON_MATRIX_CSR:
-        row_count = 0
-        mat.append(0)
-
-        # 读取非0行
-        col_items = []
-        p = 1
-        for r in range(1, sh.nrows):
-            col_count = 0
-            for c in range(1, sh.ncols):
-                val = sh.cell(r, c).value
-                val = change_type(val, pyt)
-                if not val == 0:
-                    col_count = col_count + 1
-                    col_items.append(c - 1)
-                    col_items.append(val)
-            if col_count > 0:
-                row_count = row_count + 1
-                mat.append(r - 1)
-                mat.append(p)
-                p = p + col_count*2
-
-        for i in range(1, row_count):
-            index = i*2+1+1
-            mat[index] = mat[index] + row_count*2
-
-        mat[0] = row_count
-        for x in col_items:
-            mat.append(x)
-
-        mat[0] = row_count
-    else:
-        for r in range(1, sh.nrows):
-            col_count = 0
-            for c in range(1, sh.ncols):
-                val = sh.cell(r, c).value
-                val = change_type(val, pyt)
-                mat.append(val)
-
-    col_head = [change_type(sh.cell(1, i).value, pyt) for i in range(1, sh.ncols)]
-    row_head = [change_type(sh.cell(i, 0).value, pyt) for i in range(2, sh.nrows)]
+    for i, name in enumerate(data_fields):
+        info.fields.append(ExcelFieldInfo(name, 'int[]', i+2, ''))
 
-    info.data = {"matrix": mat, "col_head": col_head, "row_head": row_head}
+    # cell(0,1)~cell(0,n)为列头 cell(1,0)~cell(n,0)为行头
+    convert = get_value_converter(INT)
+    data["col_head"] = [convert(x) for x in sh.row_values(0, 1)]
+    data["row_head"] = [convert(x) for x in sh.col_values(0, 1)]
+    info.data = data
 
     return info
 
@@ -365,167 +1031,191 @@ def get_container_type(book, sh):
     return str(sh.cell(0,0).value)
 
 
-def filter_fields(info_dict, filter_string):
-    """Remove fields which is matched in the filter string
+def get_foreign_index(index_cache, f_sheet_name, f_sheet_info, attrs):
+    """按外键字段构造哈希索引，同一(sheet, keys)只构造一次
 
     Args:
-        info_dict:dict
-        match:string
+        index_cache:dict
+        f_sheet_name:str
+        f_sheet_info:ExcelSheetInfo
+        attrs:tuple 外键字段名
+
+    Returns:
+        (index, key_types) index: 外键字段的值(tuple) => 外表的行号list, 索引不可用时(字段不是基础类型)返回(None, None)
     """
-    for sheet_info in info_dict.values():
-        delete_keys = []
-        for i in range(len(sheet_info.fields), 0, -1):
-            field = sheet_info.fields[i]
-            if field.filter and field.filter in filter_string:
-                delete_keys.append(f.name)
-                del sheet_info.fields[i]
-        
-        if sheet_info.con_type == CON_OBJECT:
-            for k in delete_keys:
-                del sheet_info.data[k]
-        elif sheet_info.con_type == CON_LIST:
-            for obj in sheet_info.data:
-                for k in delete_keys:
-                    del obj[k]
-        elif sheet_info.con_type == CON_DICT:
-            if type(sheet_info.data) == list:
-                for obj in sheet_info.data:
-                    if type(obj) == dict:
-                        for k in delete_keys:
-                            del obj[k]
-            elif type(sheet_info.data) == dict:
-                for obj in sheet_info.data.values():
-                    if type(obj) == dict:
-                        for k in delete_keys:
-                            del obj[k]
+    cache_key = (f_sheet_name, attrs)
+    if cache_key in index_cache:
+        return index_cache[cache_key]
+
+    field_types = {f.name: f.type for f in f_sheet_info.fields}
+    key_types = []
+    for attr in attrs:
+        py_type = get_lang_type(field_types.get(attr, ''))
+        if py_type is None:
+            index_cache[cache_key] = (None, None)
+            return index_cache[cache_key]
+        key_types.append(py_type)
+
+    columns = f_sheet_info.data.columns
+    index = {}
+    for j, k in enumerate(zip(*[columns[f_sheet_info.get_field_index(attr)] for attr in attrs])):
+        if k in index:
+            index[k].append(j)
         else:
-            print('Error:matrix does not support filter')
+            index[k] = [j]
+
+    index_cache[cache_key] = (index, key_types)
+    return index_cache[cache_key]
+
 
+def find_foreign_objects(f_sheet_info, attrs, conds):
+    """逐行比较查找外链对象(索引不可用时使用)
 
-def assemble_foreign_item(info_dict):
+    Returns:
+        list 外表的行号
+    """
+    table = f_sheet_info.data
+    columns = [table.columns[f_sheet_info.get_field_index(attr)] for attr in attrs]
+    lst = []
+    for j in range(table.count):
+        found = True
+        for (cond, column) in zip(conds, columns):
+            val = column[j]
+            if not (change_type(cond, type(val)) == val):
+                found = False
+                break
+        if found:
+            lst.append(j)
+    return lst
+
+
+def assemble_foreign_item(info_dict, profiler=None):
     """组装外链对象
 
     Args:
         info_dict
+        profiler:Profiler
     """
+    index_cache = {}
     for sheet_info in info_dict.values():
         if sheet_info.con_type == CON_DICT or sheet_info.con_type == CON_LIST:
             foreign_key_fields = [f for f in sheet_info.fields if f.foreign_key]
-            for f in foreign_key_fields:
-                attrs = f.foreign_key.keys
-                f_sheet_name = f.foreign_key.sheet_name
-                field_name = f.name
-                con_result_type = f.foreign_key.result_type
-
-                if not f_sheet_name in info_dict:
-                    print('Error:Foreign sheet [{0}] is not found'.format(f_sheet_name))
-                    continue
-
-                f_sheet_info = info_dict[f_sheet_name]
-                if not(f_sheet_info.con_type == CON_LIST or f_sheet_info.con_type == CON_DICT):
-                    print('Error:The con_type of the foreign sheet [{0}] must be \'list\' or \'dict\''.format(f_sheet_name))
-                    continue
+            if not foreign_key_fields:
+                continue
+            with profile_stage(profiler, 'foreign', sheet_info.filename, sheet_info.name) as record:
+                assemble_sheet_foreign_item(info_dict, sheet_info, foreign_key_fields, index_cache)
+                record['rows'] = len(sheet_info.data)
+                record['cells'] = len(sheet_info.data) * len(foreign_key_fields)
+
+
+def assemble_sheet_foreign_item(info_dict, sheet_info, foreign_key_fields, index_cache):
+    """组装一个表的外链对象"""
+    for f in foreign_key_fields:
+        attrs = f.foreign_key.keys
+        f_sheet_name = f.foreign_key.sheet_name
+        field_name = f.name
+        con_result_type = f.foreign_key.result_type
+
+        if not f_sheet_name in info_dict:
+            sheet_info.add_error(ERROR_FOREIGN_KEY, 'foreign sheet [{0}] is not found'.format(f_sheet_name), field=field_name)
+            continue
 
-                for item in sheet_info.data:
-                    conds = item[field_name]
-                    if not conds:
-                        continue
-
-                    foreign_result = None
-                    for fobj in f_sheet_info.data:
-                        found = True
-                        for (cond, attr) in zip(conds, attrs):
-                            val = fobj[attr]
-                            if not (change_type(cond, type(val)) == val):
-                                found = False
-                                break
-                        
-                        if found:
-                            if con_result_type == CON_LIST:
-                                if foreign_result is None:
-                                    foreign_result = []
-                                foreign_result.append(fobj)
-                            elif con_result_type == CON_DICT:
-                                if foreign_result is None:
-                                    foreign_result = {}
-                                pk = f_sheet_info.fields[0].name
-                                k = fobj[pk]
-                                foreign_result[k] = fobj
-                            elif con_result_type == CON_OBJECT:
-                                foreign_result = fobj
-                                break
-                            
-                    if foreign_result:
-                        item[field_name] = foreign_result
-                    else:
-                        print("Error:forign not found=>{0}.{1} {2}:{3} {4}".format(sheet_info.filename,sheet_info.name, field_name, attrs, conds))
+        f_sheet_info = info_dict[f_sheet_name]
+        if not(f_sheet_info.con_type == CON_LIST or f_sheet_info.con_type == CON_DICT):
+            message = 'the con_type of the foreign sheet [{0}] must be \'list\' or \'dict\''.format(f_sheet_name)
+            sheet_info.add_error(ERROR_FOREIGN_KEY, message, field=field_name)
+            continue
 
+        # 外表的字段可能被--filter过滤
+        f_field_names = set(x.name for x in f_sheet_info.fields)
+        missing = [x for x in attrs if x not in f_field_names]
+        if missing:
+            message = 'foreign field {0} is not found in [{1}]'.format(','.join(missing), f_sheet_name)
+            sheet_info.add_error(ERROR_FOREIGN_KEY, message, field=field_name)
+            continue
 
-                
+        col = sheet_info.get_field_index(field_name)
+        values = list(sheet_info.data.columns[col])
+        key_column = f_sheet_info.data.columns[0]
+        # 第i行的结果是indexes[offsets[i]:offsets[i+1]]
+        offsets = array('q', [0])
+        indexes = array('q')
+        for i, conds in enumerate(values):
+            if not conds:
+                offsets.append(len(indexes))
+                continue
 
+            # 条件数量少于外键字段数量时只比较前面的字段
+            n = min(len(conds), len(attrs))
+            index, key_types = get_foreign_index(index_cache, f_sheet_name, f_sheet_info, tuple(attrs[:n]))
+            if index is None:
+                fobjs = find_foreign_objects(f_sheet_info, attrs, conds)
+            else:
+                k = tuple(change_type(cond, t) for (cond, t) in zip(conds, key_types))
+                fobjs = index.get(k, [])
+
+            if fobjs:
+                if con_result_type == CON_LIST:
+                    indexes.extend(fobjs)
+                elif con_result_type == CON_DICT:
+                    # 与dict一样, key重复时保留最后一行, 顺序是key第一次出现的顺序
+                    foreign_result = {}
+                    for j in fobjs:
+                        foreign_result[key_column[j]] = j
+                    indexes.extend(foreign_result.values())
+                elif con_result_type == CON_OBJECT:
+                    indexes.append(fobjs[0])
+
+            if len(indexes) > offsets[-1]:
+                values[i] = None
+            elif any(conds):
+                # 空单元格的条件是[''], 表示没有引用, 不是错误
+                message = 'foreign row not found {0}{1} = {2}'.format(f_sheet_name, attrs, conds)
+                sheet_info.add_error(ERROR_FOREIGN_KEY, message, LIST_START_ROW + i + 1, field_name, conds)
+            offsets.append(len(indexes))
+        sheet_info.data.columns[col] = ForeignColumn(f_sheet_name, con_result_type, values, offsets, indexes)
 
 
 def assemble_data_dict(info_dict):
-    data_dict = {}
-    for sheet_info in info_dict.values():
-        if sheet_info.con_type == CON_DICT:
-            key_field_name = sheet_info.fields[0].name
-            data = {}
-            for item in sheet_info.data:
-                key = item[key_field_name]
-                data[key] = item
-        else:
-            data = sheet_info.data
-        data_dict[sheet_info.name] = data
-    return data_dict
+    """list/dict表仍然是ExcelTable, 导出时才按layout转换(见RowSchemas)"""
+    return {sheet_info.name: sheet_info.data for sheet_info in info_dict.values()}
 
 
 def merge_array_item_fields(info_dict):
     """如果字段中出现下划线加数字结尾，则视为数组结构，进行合并操作
     ids_0:int,ids_1:int... => ids:int[]
 
+    读取表头时已经由fold_array_fields合并, 这里只合并元素是外键的数组(外链之后才能合并)
+
     Args:
         info_dict
     """
     for sheet_info in info_dict.values():
         # find array item mark
+        names = set(f.name for f in sheet_info.fields)
         merge_fields_dict = {}
         for f in sheet_info.fields:
-            split_pos = f.name.rfind('_')
-            field_name = f.name[:split_pos]
-            if split_pos > 0 and f.name[split_pos+1:].isnumeric():
-                is_exists = False
-                for f2 in sheet_info.fields:
-                    if f2.name == field_name:
-                        is_exists
-                        break
-                
-                if not is_exists:
-                    if not field_name in merge_fields_dict:
-                        merge_fields_dict[field_name] = []
-                    merge_fields_dict[field_name].append(f)
-            else:
-                # not array item
-                pass
-        
+            field_name = get_array_item_name(f.name)
+            if field_name and not field_name in names:
+                if not field_name in merge_fields_dict:
+                    merge_fields_dict[field_name] = []
+                merge_fields_dict[field_name].append(f)
+        if not merge_fields_dict:
+            continue
 
+        old_names = [f.name for f in sheet_info.fields]
         for new_field_name in merge_fields_dict:
             merge_fields = merge_fields_dict[new_field_name]
-            sheet_info.fields.append(ExcelFieldInfo(new_field_name, merge_fields[0].type+"[]", -1, merge_fields[0].filter))
+            new_field = ExcelFieldInfo(new_field_name, merge_fields[0].type+"[]", -1, merge_fields[0].filter)
+            new_field.items = merge_fields
+            sheet_info.fields.append(new_field)
             
             # delete fields
             for f in merge_fields:
                 sheet_info.fields.remove(f)
             
-            # merge data
-            if sheet_info.con_type == CON_LIST or sheet_info.con_type == CON_DICT:
-                for obj in sheet_info.data:
-                    lst = []
-                    for f in merge_fields:
-                        lst.append(obj[f.name])
-                        del obj[f.name]
-                    obj[new_field_name] = lst
-            elif sheet_info.con_type == CON_OBJECT:
+            # merge data, list/dict表的列在字段顺序确定之后按位置重组
+            if sheet_info.con_type == CON_OBJECT:
                 lst = []
                 obj = sheet_info.data
                 for f in merge_fields:
@@ -533,18 +1223,157 @@ def merge_array_item_fields(info_dict):
                     del obj[f.name]
                 obj[new_field_name] = lst
 
+        # 与读取表头时合并的数组字段一起按第一个元素的列排序, 顺序与全部在这里合并时相同
+        fields = [f for f in sheet_info.fields if not f.items]
+        fields.extend(sorted((f for f in sheet_info.fields if f.items), key=lambda f: f.items[0].index))
+        if sheet_info.con_type == CON_LIST or sheet_info.con_type == CON_DICT:
+            sheet_info.fields = fields
+            columns = sheet_info.data.columns
+            sheet_info.data.columns = [
+                ArrayColumn(f.foreign_key and f.foreign_key.sheet_name, [columns[old_names.index(x.name)] for x in f.items])
+                if f.name in merge_fields_dict else columns[old_names.index(f.name)] for f in fields]
+        elif [f.name for f in fields] != [f.name for f in sheet_info.fields]:
+            sheet_info.fields = fields
+            names = [f.name for f in fields]
+            if sheet_info.con_type == CON_OBJECT:
+                sheet_info.data = {k: sheet_info.data[k] for k in names}
+
+
+def is_simple_array_sheet(sheet_info):
+    """只有一个字段"_"的list表, 导出为这个字段的值的list"""
+    return sheet_info.con_type == CON_LIST and [f.name for f in sheet_info.fields] == ['_']
+
 
 def assemble_simple_array_sheet(info_dict):
-    """构造简单的数组
+    """构造简单的数组, 数据仍然是ExcelTable(可以被外链引用), 导出时才转换为list
 
     Args:
         info_dict
     """
     for sheet_info in info_dict.values():
-        key = sheet_info.fields[0].name
-        if sheet_info.con_type == CON_LIST and 1 == len(sheet_info.fields) and key == '_':
-            lst = [x[key] for x in sheet_info.data]
-            sheet_info.data = lst
+        if is_simple_array_sheet(sheet_info):
+            sheet_info.layout = LAYOUT_ROWS
+
+
+class RowSchemas:
+    """导出时把ExcelTable转换为每行一个dict(或者按列的dict), 在process_info_dict之后创建
+
+    外链的结果按行号转换为外表的行; pool_names中的外表是引用池(--foreign_ref), 外链的结果只导出行号
+    """
+    def __init__(self, info_dict, pool_names=()):
+        self.pool_names = set(pool_names)
+        self.sheets = {}
+        # sheet_name => (字段名, 列, 外链的列[(字段名, 列)])
+        self.tables = {}
+        for sheet_info in info_dict.values():
+            if type(sheet_info.data) != ExcelTable:
+                continue
+            names = [f.name for f in sheet_info.fields]
+            columns = sheet_info.data.columns
+            foreign = [(name, column) for name, column in zip(names, columns)
+                       if type(column) == ForeignColumn or type(column) == ArrayColumn]
+            self.sheets[sheet_info.name] = sheet_info
+            self.tables[sheet_info.name] = (names, columns, foreign)
+
+    def get_value(self, column, i, memo=None):
+        """第i行的值, 外链的结果转换为外表的行(或者引用池的行号), 没有找到外链对象或外键为空时原样返回"""
+        if type(column) == ArrayColumn:
+            return [self.get_value(x, i, memo) for x in column.items]
+        if type(column) != ForeignColumn:
+            return column[i]
+        start, end = column.offsets[i], column.offsets[i + 1]
+        if start == end:
+            return column.values[i]
+        is_ref = column.sheet_name in self.pool_names
+        if column.result_type == CON_OBJECT:
+            j = column.indexes[start]
+            return j if is_ref else self.get_row(column.sheet_name, j, memo)
+        rows = column.indexes[start:end]
+        if column.result_type == CON_DICT:
+            key_column = self.sheets[column.sheet_name].data.columns[0]
+            return {key_column[j]: j if is_ref else self.get_row(column.sheet_name, j, memo) for j in rows}
+        return [j if is_ref else self.get_row(column.sheet_name, j, memo) for j in rows]
+
+    def get_row(self, sheet_name, i, memo=None):
+        """第i行转换为{字段名:值}
+
+        Args:
+            memo:dict (sheet_name, i) => dict 不为None时同一行只转换一次, 转换结果是同一个对象
+        """
+        if memo is not None:
+            obj = memo.get((sheet_name, i))
+            if obj is not None:
+                return obj
+        names, columns, foreign = self.tables[sheet_name]
+        obj = dict(zip(names, [column[i] for column in columns]))
+        for name, column in foreign:
+            obj[name] = self.get_value(column, i, memo)
+        if memo is not None:
+            memo[(sheet_name, i)] = obj
+        return obj
+
+    def get_positions(self, sheet_name):
+        """导出的行号, list表是range; dict表为{key:行号}, key重复时保留最后一行"""
+        sheet_info = self.sheets[sheet_name]
+        count = sheet_info.data.count
+        if sheet_info.con_type != CON_DICT or sheet_name in self.pool_names or not sheet_info.fields:
+            return range(count)
+        key_column = sheet_info.data.columns[0]
+        positions = {}
+        for i in range(count):
+            positions[key_column[i]] = i
+        return positions
+
+    def get_row_converter(self, sheet_name):
+        """按行导出的list/dict表(包括引用池)逐行转换的函数, 其它表返回None(需要用materialize_sheet整个转换)"""
+        sheet_info = self.sheets.get(sheet_name)
+        if sheet_info is None:
+            return None
+        if sheet_name not in self.pool_names:
+            if sheet_info.layout == LAYOUT_COLUMNAR or is_simple_array_sheet(sheet_info):
+                return None
+        return lambda i: self.get_row(sheet_name, i)
+
+    def materialize_sheet(self, sheet_name, sheet_data, memo=None):
+        """一个表导出的数据转换为dict/list, 结果与每行一个dict时相同; 不是ExcelTable时原样返回
+
+        Args:
+            memo:dict 见get_row
+        """
+        if type(sheet_data) != ExcelTable or sheet_name not in self.sheets:
+            return sheet_data
+        sheet_info = self.sheets[sheet_name]
+        positions = self.get_positions(sheet_name)
+        if sheet_name in self.pool_names:
+            return [self.get_row(sheet_name, i, memo) for i in positions]
+        if is_simple_array_sheet(sheet_info):
+            column = sheet_data.columns[0]
+            return [self.get_value(column, i, memo) for i in positions]
+        if sheet_info.layout == LAYOUT_COLUMNAR:
+            names, columns, _ = self.tables[sheet_name]
+            if type(positions) == dict:
+                positions = list(positions.values())
+            return {'count': len(positions),
+                    'columns': {name: [self.get_value(column, i, memo) for i in positions]
+                                for name, column in zip(names, columns)}}
+        if type(positions) == dict:
+            return {k: self.get_row(sheet_name, i, memo) for k, i in positions.items()}
+        return [self.get_row(sheet_name, i, memo) for i in positions]
+
+
+def get_row_schemas(info_dict, foreign_ref=False):
+    """导出时转换ExcelTable的RowSchemas, 在process_info_dict之后调用; foreign_ref=True时外表按引用池导出"""
+    return RowSchemas(info_dict, get_pool_sheet_names(info_dict) if foreign_ref else ())
+
+
+def materialize_data(data, schemas):
+    """所有表的ExcelTable转换为dict/list, 同一外表行嵌入多个表时转换结果是同一个对象
+
+    补丁、加载模块、分片和字符串表需要按字段名访问行, 使用这些功能时导出之前整体转换;
+    只导出数据文件时由write_export_file逐行转换, 不会同时保存所有的dict
+    """
+    memo = {}
+    return {k: schemas.materialize_sheet(k, v, memo) for k, v in data.items()}
 
 
 def assemble_meta_dict(info_dict):
@@ -567,9 +1396,25 @@ def assemble_meta_dict(info_dict):
         filename = sheet_info.filename
 
         meta_dict[sheet_info.name] = {"type":type, 'filename':filename, 'name':sheet_info.name, 'fields':fields, 'primary_key':pk}
+        if sheet_info.layout != LAYOUT_ROWS:
+            meta_dict[sheet_info.name]['layout'] = sheet_info.layout
     return meta_dict
 
 
+# meta中由导出参数决定的key, 切换参数时不算字段定义变更
+META_OPTION_KEYS = ('layout',)
+META_FIELD_OPTION_KEYS = ('ref', 'interned')
+
+
+def get_meta_definition(sheet_meta):
+    """去掉由导出参数决定的key, 只保留表格中的定义"""
+    definition = {k: v for k, v in sheet_meta.items() if k not in META_OPTION_KEYS}
+    if 'fields' in definition:
+        definition['fields'] = [{k: v for k, v in f.items() if k not in META_FIELD_OPTION_KEYS}
+                                for f in definition['fields']]
+    return definition
+
+
 def diff_meta(meta_filepath, meta):
     """比较当前meta信息和历史记录的meta信息是否不同
 
@@ -586,189 +1431,2184 @@ def diff_meta(meta_filepath, meta):
             last_def = json.load(f)
             lst  = []
             for k in meta:
-                if k in last_def and not meta[k] == last_def[k]:
+                if k in last_def and not get_meta_definition(meta[k]) == get_meta_definition(last_def[k]):
                     lst.append('{0}.{1}'.format(meta[k]['filename'], k))
             return lst
     return False
 
 
-def get_excels_info_dict(excel_dir, ignore_filenames):
-    """读取目录下的Excel文件转换成预处理的数据结构
+def get_excel_filenames(excel_dir, ignore_filenames):
+    """列出目录下需要导出的Excel文件, 按文件名排序保证导出顺序稳定
 
     Args:
         excel_dir
         ignore_filenames
-    
+
     Returns:
-        dict
+        list
     """
     ignore_filenames = [x.lower() for x in ignore_filenames]
-    info_dict = {}
-    for filename in os.listdir(excel_dir):
+    filenames = []
+    for filename in sorted(os.listdir(excel_dir)):
         if not is_excel_file(filename) or re.search(r'[^a-zA-Z0-9_+\-.]', filename) or (filename.lower() in ignore_filenames):
             continue
-        filepath = os.path.join(excel_dir, filename)
-        book = xlrd.open_workbook(filepath, encoding_override='utf-8')
-        
-        filename_no_ext = os.path.splitext(filename)[0]
-        filename_no_ext = filename_no_ext.replace('+', '').replace('-', '')
+        filenames.append(filename)
+    return filenames
 
-        for sh in book.sheets():
-            if sh.nrows == 0:
-                continue
-            con_type  = get_container_type(book, sh)
-            sheet_info = ExcelSheetInfo()
-            sheet_info.filename = filename_no_ext
-            sheet_info.con_type = con_type
-            sheet_info.name = sh.name
-
-            if con_type == CON_LIST:
-                if sh.nrows >= 5:
-                    parse_excel_list(sh, sheet_info)
-            elif con_type == CON_DICT:
-                if sh.nrows >= 5:
-                    parse_excel_list(sh, sheet_info)
-            elif con_type == CON_OBJECT:
-                if sh.ncols >= 5:
-                    parse_excel_object(sh, sheet_info)
-            elif con_type == CON_MATRIX or con_type == CON_MATRIX_CSR:
-                if sh.nrows >= 2:
-                    parse_excel_mat(sh, sheet_info)
-
-            if sheet_info.fields:
-                if sh.name in info_dict:
-                    info = info_dict[sh.name]
-                    print("Error: {0}.{1} = {2}.{3}".format(info.filename, info.name, sheet_info.filename, sheet_info.name))
-                else:
-                    info_dict[filename_no_ext] = sheet_info
-    
-    return info_dict
 
-def parse(excel_dir, filter_string, ignore_filenames):
-    info_dict = get_excels_info_dict(excel_dir, ignore_filenames)
+def get_excel_stats(excel_dir, ignore_filenames):
+    """需要导出的Excel文件的大小和修改时间, 用于判断文件是否修改过
 
-    assemble_foreign_item(info_dict)
+    Returns:
+        dict filename => (size, mtime) 按文件名排序
+    """
+    stats = {}
+    for filename in get_excel_filenames(excel_dir, ignore_filenames):
+        try:
+            stat = os.stat(os.path.join(excel_dir, filename))
+        except OSError:
+            continue
+        stats[filename] = (stat.st_size, stat.st_mtime)
+    return stats
 
-    if filter_string:
-        filter_fields(info_dict, filter_string)
 
-    merge_array_item_fields(info_dict)
-    assemble_simple_array_sheet(info_dict)
+def sheet_has_rows(sh, n):
+    """sheet是否至少有n行, .xlsx只读取前n行"""
+    if isinstance(sh, xlsxreader.XlsxSheet):
+        return sh.has_rows(n)
+    return sh.nrows >= n
 
-    ret_data_dict = assemble_data_dict(info_dict)
-    ret_meta_dict = assemble_meta_dict(info_dict)
 
-    # del foreign sheet
-    for sheet_info in info_dict.values():
-        for f in sheet_info.fields:
-            if f.foreign_key:
-                del ret_data_dict[f.foreign_key.sheet_name]
+def open_workbook(filepath):
+    """.xlsx使用xlsxreader流式读取, 其它文件使用xlrd, sheet都是按需加载"""
+    if filepath.endswith('.xlsx'):
+        return xlsxreader.open_workbook(filepath)
+    return xlrd.open_workbook(filepath, encoding_override='utf-8', on_demand=True)
 
-    return (ret_data_dict, ret_meta_dict)
 
+def parse_excel_sheet(book, sh, filename_no_ext, profiler=None, filter_string=''):
+    """按cell(0,0)定义的容器类型解析sheet, 被filter_string过滤的字段不读取
 
-def main():
-    args = argparse.ArgumentParser()
-    args.add_argument('--excel_dir', default='./')
-    args.add_argument('--export_dir', default='./')
-    args.add_argument('--filter', default='', help='Filter string. "c,s"')
-    args.add_argument('--ignore', default='', help='Ignore list. "Item,Goods"')
-    args.add_argument('--merge_to_file', default='config.json', help='It is used when iseparate_type=3 ')
-    args.add_argument('--separate_type', default= 3, type=int, help="1 separate with sheet, 2 separate with file  3 all in one")
-    args.add_argument('--chdir', default=None)
-    args.add_argument('--param', default=None, help='init argument file')
-    arg = args.parse_args()
+    Returns:
+        ExcelSheetInfo 没有可导出的字段时返回None
+    """
+    if not sheet_has_rows(sh, 1):
+        return None
+    con_type  = get_container_type(book, sh)
+    layout = LAYOUT_ROWS
+    # list(columnar) dict(columnar) 按列导出
+    columnar_suffix = '({0})'.format(LAYOUT_COLUMNAR)
+    if con_type in (CON_LIST + columnar_suffix, CON_DICT + columnar_suffix):
+        con_type = con_type[:-len(columnar_suffix)]
+        layout = LAYOUT_COLUMNAR
+    if not con_type in CON_TYPES:
+        return None
+
+    sheet_info = ExcelSheetInfo()
+    sheet_info.filename = filename_no_ext
+    sheet_info.con_type = con_type
+    sheet_info.name = sh.name
+    sheet_info.layout = layout
+
+    if con_type == CON_LIST:
+        if sheet_has_rows(sh, 5):
+            parse_excel_list(sh, sheet_info, profiler, filter_string)
+    elif con_type == CON_DICT:
+        if sheet_has_rows(sh, 5):
+            parse_excel_list(sh, sheet_info, profiler, filter_string)
+    elif con_type == CON_OBJECT:
+        if sh.ncols >= 5:
+            with profile_stage(profiler, 'rows', filename_no_ext, sh.name) as record:
+                parse_excel_object(sh, sheet_info, filter_string)
+                record['rows'] = record['cells'] = len(sheet_info.fields)
+    elif con_type in CON_MATRIX_TYPES:
+        if sh.nrows >= 2:
+            with profile_stage(profiler, 'rows', filename_no_ext, sh.name) as record:
+                parse_excel_mat(sh, sheet_info)
+                record['rows'] = sh.nrows - 1
+                record['cells'] = (sh.nrows - 1) * (sh.ncols - 1)
+
+    if sheet_info.fields:
+        return sheet_info
+    return None
 
-    if arg.param:
-        if os.path.exists(arg.param):
-            with open(arg.param, mode='r', encoding='utf-8') as f:
-                param = json.load(f)
-                chdir = param.get('chdir', None)
-                ignore = param.get('ignore', '')
-                filter = param.get('filter', '')
-                excel_dir = param.get('excel_dir', './')            
-                export_dir = param.get('export_dir', './')
-                merge_to_file = param.get('merge_to_file', 'config.json')
-                separate_type = param.get('separate_type', 3)
-        else:
-            param = {                
-                'excel_dir':'./',
-                'export_dir':'./',
-                'merge_to_file':'config.json',
-                'separate_type':3,
-                'ignore':'',
-                'filter':'',
-            }
-            with open(arg.param, mode='w') as f:
-                json.dump(param, f, ensure_ascii=False, indent=True)
-            print('{0} is created.... first time. This time i did not read excel files'.format(arg.param))
-            return
-            
-    else:
-        chdir = arg.chdir
-        ignore = arg.ignore
-        filter = arg.filter
-        excel_dir = arg.excel_dir        
-        export_dir = arg.export_dir
-        merge_to_file = arg.merge_to_file
-        separate_type = arg.separate_type
 
-    if chdir:
-        os.chdir(chdir)
-    
-    ignore_filenames = ignore.split(',')
-    data, meta = parse(excel_dir, filter, ignore_filenames)
+def parse_excel_file(filepath, profiler=None, filter_string=''):
+    """读取一个Excel文件的所有sheet
 
-    meta_filepath = os.path.join(excel_dir,'.meta.txt')
-    changed_items = diff_meta(meta_filepath, meta)
+    sheet按需加载, 解析完立即释放, 同一时间只有一个sheet在内存中
 
-    if diff_meta(meta_filepath, meta):
-        print("Error:")
-        print('Those are excel files which field defines are changed.')
-        print(changed_items)
-        print('Please check out carefully. \nIf you make sure to create new meta file, please delete \".meta.txt\" at first.\n')
-    else:
-        with open(meta_filepath, mode='w') as f:
-            json.dump(meta, f, ensure_ascii=False, indent=True)
+    Args:
+        filepath
+        profiler:Profiler
+        filter_string:str --filter
 
-        if separate_type == 3:
-            # all in one
-            json_filepath = os.path.join(export_dir, merge_to_file)
-            with open(json_filepath, mode='w') as f:
-                json.dump(data, f, ensure_ascii=False)
-        elif separate_type == 2:
-            # Separate with excel file
-            group = {}
-            for k in meta:
-                m = meta[k]
-                filename = m['filename']
-                if not filename in group:
-                    group[filename] = []
-                group[filename].append(m['name'])
-            
-            for k in group:
-                file_pack = {}
-                for sheet_name in group[k]:
-                    if sheet_name in data:
-                        file_pack[sheet_name] = data[sheet_name]
-                
-                if file_pack:
-                    json_filepath = os.path.join(export_dir, k+'.json')
-                    with open(json_filepath, mode='w') as f:
-                        json.dump(file_pack, f, ensure_ascii=False)
-
-
-        elif separate_type == 1:
-            # Separate with sheet
-            for k in data:
-                sheet_pack = data[k]
-                json_filepath = os.path.join(export_dir, k+'.json')
-                with open(json_filepath, mode='w') as f:
-                    json.dump(sheet_pack, f, ensure_ascii=False)
-        else:
-            print("Error:separate_type value error.")
+    Returns:
+        list of ExcelSheetInfo
+    """
+    filename_no_ext = os.path.splitext(os.path.basename(filepath))[0]
+    filename_no_ext = filename_no_ext.replace('+', '').replace('-', '')
+
+    with profile_stage(profiler, 'open', filename_no_ext):
+        book = open_workbook(filepath)
+
+    sheet_infos = []
+    try:
+        for i in range(book.nsheets):
+            with profile_stage(profiler, 'open', filename_no_ext, book.sheet_names()[i]) as record:
+                sh = book.sheet_by_index(i)
+                if not isinstance(sh, xlsxreader.XlsxSheet):
+                    record['rows'] = sh.nrows
+                    record['cells'] = sh.nrows * sh.ncols
+            try:
+                sheet_info = parse_excel_sheet(book, sh, filename_no_ext, profiler, filter_string)
+            finally:
+                book.unload_sheet(i)
+                del sh
+            if sheet_info:
+                sheet_infos.append(sheet_info)
+    finally:
+        book.release_resources()
+    return sheet_infos
+
+
+def parse_excel_file_profiled(filepath, filter_string=''):
+    """在子进程中读取文件并记录profile
+
+    Returns:
+        (list of ExcelSheetInfo, profile records)
+    """
+    profiler = Profiler()
+    return (parse_excel_file(filepath, profiler, filter_string), profiler.records)
+
+
+def get_file_digest(filepath):
+    """计算文件内容的sha1
+
+    Args:
+        filepath
+
+    Returns:
+        str
+    """
+    h = hashlib.sha1()
+    with open(filepath, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
 
+def load_parse_cache(cache_filepath, options):
+    """读取解析缓存, 版本或解析参数不同时缓存失效
+
+    Args:
+        cache_filepath
+        options:dict 影响解析结果的参数
+
+    Returns:
+        dict filename => {size, mtime, digest, sheet_infos}
+    """
+    if not os.path.isfile(cache_filepath):
+        return {}
+    try:
+        with open(cache_filepath, mode='rb') as f:
+            cache = pickle.load(f)
+    except Exception:
+        print('Warning:parse cache is broken, ignore it. {0}'.format(cache_filepath))
+        return {}
+    if cache.get('version') != VERSION or cache.get('options') != options:
+        return {}
+    return cache.get('files', {})
+
+
+def save_parse_cache(cache_filepath, options, files):
+    """保存解析缓存, 先写临时文件再替换
+
+    Args:
+        cache_filepath
+        options:dict
+        files:dict
+    """
+    cache = {'version': VERSION, 'options': options, 'files': files}
+    tmp_filepath = cache_filepath + '.tmp'
+    try:
+        cache_dir = os.path.dirname(cache_filepath)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_filepath, mode='wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError as e:
+        print('Warning:parse cache is not saved. {0} {1}'.format(cache_filepath, e))
+
+
+def get_cache_filepath(excel_dir, cache_dir=''):
+    """解析缓存文件, 保存在当前用户的缓存目录中, 不写入(可能共享的)excel_dir
+
+    Args:
+        excel_dir
+        cache_dir:str 为空时Windows为%LOCALAPPDATA%/excel2json, 其它系统为$XDG_CACHE_HOME(或~/.cache)/excel2json
+
+    Returns:
+        str 每个excel_dir一个文件, 文件名为excel_dir绝对路径的sha1
+    """
+    if not cache_dir:
+        base = os.environ.get('LOCALAPPDATA' if sys.platform == 'win32' else 'XDG_CACHE_HOME')
+        cache_dir = os.path.join(base or os.path.join(os.path.expanduser('~'), '.cache'), CACHE_DIRNAME)
+    name = hashlib.sha1(os.path.abspath(excel_dir).encode('utf-8')).hexdigest() + '.cache'
+    return os.path.join(cache_dir, name)
+
+
+def read_excel_files(excel_dir, filenames, jobs=1, cache_filepath=None, profiler=None, filter_string=''):
+    """读取Excel文件
+
+    Args:
+        excel_dir
+        filenames
+        jobs 并行读取的进程数量, 1表示在当前进程读取
+        cache_filepath 解析缓存文件, None表示不使用缓存
+        profiler:Profiler 使用缓存的文件不记录
+        filter_string:str --filter, 被过滤的字段不读取
+
+    Returns:
+        list 与filenames顺序相同, 每个元素是该文件的ExcelSheetInfo列表
+    """
+    options = {'filter': filter_string}
+
+    # 文件大小和修改时间不变, 或者内容hash不变的文件直接使用缓存
+    cached_files = load_parse_cache(cache_filepath, options) if cache_filepath else {}
+    files = {}
+    results = [None] * len(filenames)
+    parse_indexes = []
+    for i, filename in enumerate(filenames):
+        filepath = os.path.join(excel_dir, filename)
+        stat = os.stat(filepath)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': None, 'sheet_infos': None}
+        cached = cached_files.get(filename)
+        if cached and cached['size'] == entry['size'] and cached['mtime'] == entry['mtime']:
+            entry['digest'] = cached['digest']
+        elif cache_filepath:
+            entry['digest'] = get_file_digest(filepath)
+        if cached and cached['digest'] == entry['digest']:
+            for sheet_info in cached['sheet_infos']:
+                intern_sheet_strings(sheet_info)
+            entry['sheet_infos'] = cached['sheet_infos']
+            results[i] = cached['sheet_infos']
+        else:
+            parse_indexes.append(i)
+        files[filename] = entry
+
+    filepaths = [os.path.join(excel_dir, filenames[i]) for i in parse_indexes]
+    if jobs > 1 and len(filepaths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            if profiler is None:
+                parsed = list(executor.map(partial(parse_excel_file, filter_string=filter_string), filepaths))
+            else:
+                parsed = []
+                for sheet_infos, records in executor.map(partial(parse_excel_file_profiled, filter_string=filter_string), filepaths):
+                    parsed.append(sheet_infos)
+                    profiler.records.extend(records)
+    else:
+        parsed = [parse_excel_file(x, profiler, filter_string) for x in filepaths]
+
+    for i, sheet_infos in zip(parse_indexes, parsed):
+        if jobs > 1 and len(filepaths) > 1:
+            # 子进程的结果是pickle传回的
+            for sheet_info in sheet_infos:
+                intern_sheet_strings(sheet_info)
+        results[i] = sheet_infos
+        files[filenames[i]]['sheet_infos'] = sheet_infos
+
+    if cache_filepath and parse_indexes:
+        save_parse_cache(cache_filepath, options, files)
+    return results
+
+
+def intern_value(value):
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is list:
+        return [sys.intern(x) if type(x) is str else x for x in value]
+    return value
+
+
+def intern_sheet_strings(sheet_info):
+    """重新驻留string/string[]字段的值
+
+    解析缓存、--jobs子进程、--watch和Exporter的结果按文件pickle, 载入之后不同文件中相同的文本不再是同一个对象
+    """
+    positions = [i for i, f in enumerate(sheet_info.fields) if is_string_type(f.type)]
+    if not positions:
+        return
+    if sheet_info.con_type == CON_LIST or sheet_info.con_type == CON_DICT:
+        columns = sheet_info.data.columns
+        for i in positions:
+            columns[i] = [intern_value(x) for x in columns[i]]
+    elif sheet_info.con_type == CON_OBJECT:
+        for i in positions:
+            name = sheet_info.fields[i].name
+            sheet_info.data[name] = intern_value(sheet_info.data[name])
+
+
+def merge_sheet_infos(results, reintern=False):
+    """按文件名顺序合并，保证结果与串行读取一致
+
+    Args:
+        results: list of ExcelSheetInfo list
+        reintern:bool 结果是pickle载入的, 需要重新驻留字符串(见intern_sheet_strings)
+
+    Returns:
+        dict
+    """
+    info_dict = {}
+    for sheet_infos in results:
+        for sheet_info in sheet_infos:
+            if reintern:
+                intern_sheet_strings(sheet_info)
+            if sheet_info.name in info_dict:
+                info = info_dict[sheet_info.name]
+                print("Error: {0}.{1} = {2}.{3}".format(info.filename, info.name, sheet_info.filename, sheet_info.name))
+            else:
+                info_dict[sheet_info.filename] = sheet_info
+    return info_dict
+
+
+def get_excels_info_dict(excel_dir, ignore_filenames, jobs=1, cache_filepath=None, profiler=None, filter_string=''):
+    """读取目录下的Excel文件转换成预处理的数据结构
+
+    Args:
+        excel_dir
+        ignore_filenames
+        jobs 并行读取的进程数量, 1表示在当前进程读取
+        cache_filepath 解析缓存文件, None表示不使用缓存
+        filter_string:str --filter, 被过滤的字段不读取
+    
+    Returns:
+        dict
+    """
+    filenames = get_excel_filenames(excel_dir, ignore_filenames)
+    return merge_sheet_infos(read_excel_files(excel_dir, filenames, jobs, cache_filepath, profiler, filter_string))
+
+
+def process_info_dict(info_dict, columnar=False, profiler=None):
+    """完成外链、数组合并等处理(过滤在读取表头时完成)
+
+    Args:
+        info_dict
+        columnar 所有list/dict表按列导出
+        profiler:Profiler
+    """
+    if columnar:
+        for sheet_info in info_dict.values():
+            if sheet_info.con_type == CON_LIST or sheet_info.con_type == CON_DICT:
+                sheet_info.layout = LAYOUT_COLUMNAR
+
+    assemble_foreign_item(info_dict, profiler)
+
+    with profile_stage(profiler, 'array_merge'):
+        merge_array_item_fields(info_dict)
+        assemble_simple_array_sheet(info_dict)
+
+
+def parse_info_dict(excel_dir, filter_string, ignore_filenames, jobs=1, cache_filepath=None, columnar=False, profiler=None):
+    """读取Excel并完成外链、过滤、数组合并等处理
+
+    Returns:
+        dict
+    """
+    info_dict = get_excels_info_dict(excel_dir, ignore_filenames, jobs, cache_filepath, profiler, filter_string)
+    process_info_dict(info_dict, columnar, profiler)
+    return info_dict
+
+
+def assemble_validation_report(info_dict):
+    """汇总所有sheet在解析和外链时记录的校验错误
+
+    Returns:
+        list of {file, sheet, type, row, field, value, message} 按sheet和行号排序
+    """
+    report = []
+    for sheet_info in info_dict.values():
+        errors = sorted(sheet_info.errors, key=lambda x: x['row'] or 0)
+        for error in errors:
+            item = {'file': sheet_info.filename, 'sheet': sheet_info.name}
+            item.update(error)
+            report.append(item)
+    return report
+
+
+def print_validation_report(report, report_filepath=''):
+    """打印校验错误, report_filepath不为空时保存为JSON
+
+    Args:
+        report:list assemble_validation_report的结果
+        report_filepath:str
+    """
+    counts = {}
+    for error in report:
+        location = '{0}.{1}'.format(error['file'], error['sheet'])
+        if error['row']:
+            location += ' row {0}'.format(error['row'])
+        if error['field']:
+            location += ' {0}'.format(error['field'])
+        print('Error:{0}: {1}'.format(location, error['message']))
+        counts[error['type']] = counts.get(error['type'], 0) + 1
+    if report:
+        print('Validation: {0} errors {1}'.format(len(report), counts))
+
+    if report_filepath:
+        with open(report_filepath, mode='w', encoding='utf-8') as f:
+            # 外键条件等单元格的值可能不能直接转换为JSON
+            json.dump({'count': len(report), 'counts': counts, 'errors': report}, f, ensure_ascii=False, indent=True,
+                      default=str)
+
+
+def get_pool_sheet_names(info_dict):
+    """被外键引用、可以作为引用池导出的外表(list/dict表, 每行是一个对象)"""
+    names = []
+    for sheet_info in info_dict.values():
+        for f in sheet_info.fields:
+            if not f.foreign_key or f.foreign_key.sheet_name in names:
+                continue
+            f_sheet_info = info_dict.get(f.foreign_key.sheet_name)
+            if f_sheet_info is None or not (f_sheet_info.con_type == CON_LIST or f_sheet_info.con_type == CON_DICT):
+                continue
+            if not is_simple_array_sheet(f_sheet_info):
+                names.append(f.foreign_key.sheet_name)
+    return names
+
+
+def get_json_size(sheet_name, sheet_data, schemas=None):
+    """一个表导出的JSON的字节数, 按写文件时的块逐个计算, 不生成整个JSON字符串"""
+    return sum(len(chunk.encode('utf-8')) for chunk in iter_json_sheet_chunks(sheet_name, sheet_data, schemas))
+
+
+def assemble_foreign_refs(info_dict, data_dict, meta_dict):
+    """引用模式: 外表的行只在引用池中导出一次, 主表的外键字段只保存行号
+
+    引用池是外表按Excel中的顺序导出的行列表, meta中layout为pool。
+    外键字段的值: Item[] => [行号...], Item{} => {key:行号}, Item => 行号, 没有找到外链对象或外键为空时
+    与展开导出一样是原来的值(字符串的list); 元素是外键的数组(q_0..q_N)每个元素分别转换。
+    meta中外键字段增加 "ref":{"sheet":外表, "result_type":list/dict/object}, 元素是外键的数组增加"items":true。
+    数据仍然是ExcelTable, 导出时按get_row_schemas(info_dict, True)转换。
+
+    Returns:
+        list of (sheet_name, 展开导出的字节数, 引用模式的字节数) 引用池展开导出的字节数为0
+    """
+    pool_names = get_pool_sheet_names(info_dict)
+    schemas = RowSchemas(info_dict)
+    ref_schemas = RowSchemas(info_dict, pool_names)
+
+    report = []
+    ret_data_dict = {}
+    for sheet_info in info_dict.values():
+        name = sheet_info.name
+        is_pool = name in pool_names
+        if not is_pool and not name in data_dict:
+            continue
+
+        ref_fields = [f for f in sheet_info.fields if f.foreign_key and f.foreign_key.sheet_name in pool_names]
+        if is_pool:
+            sheet_data = sheet_info.data
+            meta_dict[name]['layout'] = LAYOUT_POOL
+        else:
+            sheet_data = data_dict[name]
+
+        for f in ref_fields:
+            for m in meta_dict[name]['fields']:
+                if m['name'] == f.name:
+                    m['ref'] = {'sheet': f.foreign_key.sheet_name, 'result_type': f.foreign_key.result_type}
+                    if f.items:
+                        m['ref']['items'] = True
+
+        if is_pool:
+            report.append((name, 0, get_json_size(name, sheet_data, ref_schemas)))
+        elif ref_fields:
+            report.append((name, get_json_size(name, sheet_data, schemas), get_json_size(name, sheet_data, ref_schemas)))
+        ret_data_dict[name] = sheet_data
+
+    data_dict.clear()
+    data_dict.update(ret_data_dict)
+    return report
+
+
+def print_foreign_refs_report(report):
+    """打印引用模式每个表减少的大小"""
+    before_total = 0
+    after_total = 0
+    for name, before, after in report:
+        before_total += before
+        after_total += after
+        if before:
+            print('foreign_ref {0}: {1} => {2} bytes ({3:.1f}%)'.format(name, before, after, (after - before) * 100.0 / before))
+        else:
+            print('foreign_ref {0}: pool {1} bytes'.format(name, after))
+    if before_total:
+        print('foreign_ref total: {0} => {1} bytes ({2:.1f}%)'.format(before_total, after_total, (after_total - before_total) * 100.0 / before_total))
+
+
+def is_string_type(field_type):
+    """string和string[]字段"""
+    if is_basic_value_array(field_type):
+        field_type = field_type[:field_type.index('[]')]
+    return field_type == STRING
+
+
+def get_string_fields(info_dict, foreign_ref=False):
+    """--string_table 每个表中导出为字符串表下标的字段
+
+    Returns:
+        dict sheet_name => {field_name: entry}
+        entry: True(string/string[]) 或 {"foreign":外表, "result_type":list/dict/object}(嵌入的外表行)
+        或 {"items":entry}(元素是外键的数组); 没有字符串字段的表不在结果中
+    """
+    pool_names = get_pool_sheet_names(info_dict) if foreign_ref else []
+    string_fields = {}
+    for sheet_info in info_dict.values():
+        if sheet_info.con_type in CON_MATRIX_TYPES:
+            continue
+        fields = {}
+        for f in sheet_info.fields:
+            item = f.items[0] if f.items else f
+            if item.foreign_key:
+                # 引用模式下外键字段是引用池的行号
+                if item.foreign_key.sheet_name in pool_names or item.foreign_key.sheet_name not in info_dict:
+                    continue
+                entry = {'foreign': item.foreign_key.sheet_name, 'result_type': item.foreign_key.result_type}
+                fields[f.name] = {'items': entry} if f.items else entry
+            elif is_string_type(f.type):
+                fields[f.name] = True
+        string_fields[sheet_info.name] = fields
+
+    # 去掉引用的外表中没有字符串字段的外键字段
+    def has_strings(sheet_name, visited):
+        if sheet_name in visited:
+            return False
+        visited = visited | {sheet_name}
+        for entry in string_fields.get(sheet_name, {}).values():
+            entry = entry.get('items', entry) if type(entry) == dict else entry
+            if entry is True or has_strings(entry['foreign'], visited):
+                return True
+        return False
+
+    result = {}
+    for sheet_name, fields in string_fields.items():
+        fields = {k: v for k, v in fields.items()
+                  if v is True or has_strings(v.get('items', v)['foreign'], set())}
+        if fields:
+            result[sheet_name] = fields
+    return result
+
+
+class StringTable:
+    """--string_table 所有导出文件共用的字符串表, string和string[]字段导出为表中的下标
+
+    下标按导出时第一次出现的顺序分配。不修改info_dict中的行, 转换后的行都是新的对象,
+    同一外表行嵌入多个主表时只转换一次。
+    """
+    def __init__(self, info_dict, foreign_ref=False):
+        self.fields = get_string_fields(info_dict, foreign_ref)
+        self.strings = []
+        self.indexes = {}
+        # 被嵌入的外表行 id(行) => 转换后的行
+        self.rows = {}
+        # sheet_name => [字符串数量, 不重复的字符串]
+        self.stats = {}
+        self.stat = [0, set()]
+
+    def mark_meta(self, meta):
+        """meta中导出为下标的string/string[]字段增加 "interned":true"""
+        for sheet_name, fields in self.fields.items():
+            for m in meta.get(sheet_name, {}).get('fields', []):
+                if fields.get(m['name']) is True:
+                    m['interned'] = True
+
+    def index(self, text):
+        i = self.indexes.get(text)
+        if i is None:
+            i = self.indexes[text] = len(self.strings)
+            self.strings.append(text)
+        self.stat[0] += 1
+        self.stat[1].add(text)
+        return i
+
+    def convert_value(self, value, entry):
+        if value is None:
+            return None
+        if entry is True:
+            if type(value) == str:
+                return self.index(value)
+            return [self.index(x) for x in value]
+        if 'items' in entry:
+            return [self.convert_value(x, entry['items']) for x in value]
+        sheet_name = entry['foreign']
+        if entry['result_type'] == CON_LIST and type(value) == list:
+            return [self.convert_row(sheet_name, x, True) for x in value]
+        if entry['result_type'] == CON_DICT and type(value) == dict:
+            return {k: self.convert_row(sheet_name, x, True) for k, x in value.items()}
+        if type(value) == dict:
+            return self.convert_row(sheet_name, value, True)
+        return value
+
+    def convert_row(self, sheet_name, row, shared=False):
+        if type(row) != dict:
+            # 没有找到外链对象时仍然是查询条件
+            return row
+        if shared:
+            converted = self.rows.get(id(row))
+            if converted is not None:
+                return converted
+        converted = dict(row)
+        for k, entry in self.fields[sheet_name].items():
+            if k in converted:
+                converted[k] = self.convert_value(converted[k], entry)
+        if shared:
+            self.rows[id(row)] = converted
+        return converted
+
+    def convert_sheet(self, sheet_name, sheet_data, sheet_meta):
+        """转换一个表(或一个分片)导出的数据, 没有字符串字段的表原样返回"""
+        fields = self.fields.get(sheet_name)
+        if not fields:
+            return sheet_data
+        self.stat = self.stats.setdefault(sheet_name, [0, set()])
+        if sheet_meta.get('layout') == LAYOUT_COLUMNAR:
+            columns = dict(sheet_data['columns'])
+            for k, entry in fields.items():
+                columns[k] = [self.convert_value(x, entry) for x in columns[k]]
+            return {'count': sheet_data['count'], 'columns': columns}
+        if sheet_meta['type'] == CON_OBJECT:
+            return self.convert_row(sheet_name, sheet_data)
+        if type(sheet_data) == dict:
+            return {k: self.convert_row(sheet_name, row) for k, row in sheet_data.items()}
+        if sheet_data and type(sheet_data[0]) != dict:
+            # 简单数组
+            return [self.convert_value(x, fields['_']) for x in sheet_data]
+        return [self.convert_row(sheet_name, row) for row in sheet_data]
+
+
+def print_string_table_report(table):
+    """打印每个表的字符串数量和去重比例"""
+    for sheet_name, (count, unique) in table.stats.items():
+        if count:
+            print('string_table {0}: {1} strings, {2} unique ({3:.1f}% deduplicated)'.format(
+                sheet_name, count, len(unique), (count - len(unique)) * 100.0 / count))
+    total = sum(x[0] for x in table.stats.values())
+    if total:
+        print('string_table total: {0} strings, {1} in the table ({2:.1f}% deduplicated)'.format(
+            total, len(table.strings), (total - len(table.strings)) * 100.0 / total))
+
+
+def assemble_export(info_dict, foreign_ref=False):
+    """生成导出的数据和meta, 外表的数据已经嵌入主表, 不再单独导出
+    foreign_ref=True时外表作为引用池导出, 主表只保存行号
+
+    Returns:
+        (data_dict, meta_dict)
+    """
+    ret_data_dict = assemble_data_dict(info_dict)
+    ret_meta_dict = assemble_meta_dict(info_dict)
+
+    # del foreign sheet
+    for sheet_info in info_dict.values():
+        for f in sheet_info.fields:
+            if f.foreign_key:
+                ret_data_dict.pop(f.foreign_key.sheet_name, None)
+
+    if foreign_ref:
+        print_foreign_refs_report(assemble_foreign_refs(info_dict, ret_data_dict, ret_meta_dict))
+
+    return (ret_data_dict, ret_meta_dict)
+
+
+def parse(excel_dir, filter_string, ignore_filenames, jobs=1, cache_filepath=None, columnar=False, foreign_ref=False):
+    """解析并组装导出的数据, 行都转换为dict
+
+    Returns:
+        (data_dict, meta_dict)
+    """
+    info_dict = parse_info_dict(excel_dir, filter_string, ignore_filenames, jobs, cache_filepath, columnar)
+    data, meta = assemble_export(info_dict, foreign_ref)
+    return (materialize_data(data, get_row_schemas(info_dict, foreign_ref)), meta)
+
+
+def index_key(values):
+    """索引的key, 生成的加载模块使用相同的规则"""
+    return ','.join(json.dumps(v, ensure_ascii=False) for v in values)
+
+
+def iter_sheet_locators(sheet_info, sheet_data, field_name):
+    """遍历导出数据中某个字段的值
+
+    Yields:
+        (locator, value) list表、按列导出的表和引用池locator为行号, dict表为JSON中的key
+    """
+    if sheet_info.layout == LAYOUT_COLUMNAR and type(sheet_data) == dict:
+        for i, value in enumerate(sheet_data['columns'][field_name]):
+            yield (i, value)
+    elif type(sheet_data) == dict:
+        for k, row in sheet_data.items():
+            yield (binconf.json_key(k), row[field_name])
+    else:
+        for i, row in enumerate(sheet_data):
+            yield (i, row[field_name])
+
+
+def assemble_index_dict(info_dict, data):
+    """导出时预先计算主键索引和外键反向索引, 供生成的加载模块使用
+
+    Returns:
+        dict sheet_name => {primary_key:{key:[locator]}, foreign_keys:{field:{key:[locator]}}}
+    """
+    index_dict = {}
+    for sheet_info in info_dict.values():
+        if not sheet_info.name in data or not sheet_info.fields:
+            continue
+        if not (sheet_info.con_type == CON_LIST or sheet_info.con_type == CON_DICT):
+            continue
+        sheet_data = data[sheet_info.name]
+        if sheet_info.con_type == CON_LIST and type(sheet_data) == list and sheet_data and type(sheet_data[0]) != dict:
+            # 简单数组
+            continue
+
+        field_names = [f.name for f in sheet_info.fields]
+        primary_key = {}
+        for locator, value in iter_sheet_locators(sheet_info, sheet_data, field_names[0]):
+            primary_key.setdefault(index_key([value]), []).append(locator)
+
+        foreign_keys = {}
+        for f in sheet_info.fields:
+            if not f.foreign_key:
+                continue
+            attrs = f.foreign_key.keys
+            # 引用模式下外表作为引用池导出, 字段值是池中的行号(int), 没有找到外链对象时是原来的值(字符串)
+            pool = data.get(f.foreign_key.sheet_name)
+            index = {}
+            for locator, value in iter_sheet_locators(sheet_info, sheet_data, f.name):
+                if pool is not None:
+                    if type(value) == int:
+                        value = pool[value]
+                    elif type(value) == list and all(type(x) == int for x in value):
+                        value = [pool[x] for x in value]
+                    elif type(value) == dict:
+                        value = {k: pool[x] for k, x in value.items()}
+                # 外链结果中的任意一行都包含外键字段的值
+                if type(value) == list:
+                    fobj = value[0] if value and type(value[0]) == dict else None
+                elif type(value) == dict and value and all(type(x) == dict for x in value.values()) and f.foreign_key.result_type == CON_DICT:
+                    fobj = next(iter(value.values()))
+                elif type(value) == dict:
+                    fobj = value
+                else:
+                    fobj = None
+                if fobj is None or not all(a in fobj for a in attrs):
+                    continue
+                index.setdefault(index_key([fobj[a] for a in attrs]), []).append(locator)
+            foreign_keys[f.name] = index
+
+        index_dict[sheet_info.name] = {'primary_key': primary_key, 'foreign_keys': foreign_keys}
+    return index_dict
+
+
+def write_loader_module(loader_filepath, data, meta, index_dict, merge_to_file, separate_type, manifest=None,
+                        shards=None, string_table=None, string_table_filename=''):
+    """根据meta生成加载模块和索引文件
+
+    Args:
+        loader_filepath:str 生成的python文件
+        data:dict
+        meta:dict
+        index_dict:dict assemble_index_dict的结果
+        merge_to_file:str
+        separate_type:int
+        manifest:OutputManifest
+        shards:dict assemble_shards的结果, 分片导出的表记录分片索引文件
+        string_table:StringTable 加载时把字符串表的下标还原为字符串
+        string_table_filename:str
+    """
+    groups = get_export_groups(data, meta, merge_to_file, separate_type)
+    sheets = {}
+    for json_filename, sheet_names, is_pack in groups or []:
+        for sheet_name in sheet_names:
+            m = meta[sheet_name]
+            sheets[sheet_name] = {
+                'type': m['type'],
+                'layout': m.get('layout', LAYOUT_ROWS),
+                'file': json_filename,
+                'packed': is_pack,
+                'primary_key': m['fields'][0]['name'] if m['fields'] else '',
+            }
+            refs = {x['name']: x['ref'] for x in m['fields'] if 'ref' in x}
+            if refs:
+                sheets[sheet_name]['refs'] = refs
+            if shards and sheet_name in shards:
+                sheets[sheet_name].update({'file': '', 'packed': False, 'shards': get_shard_index_filename(sheet_name)})
+
+    index_filename = os.path.splitext(os.path.basename(loader_filepath))[0] + '_index.json'
+    write_json_file(os.path.join(os.path.dirname(loader_filepath), index_filename), iter_json_chunks(index_dict), manifest)
+
+    template_filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loader_template.py')
+    with open(template_filepath, encoding='utf-8') as f:
+        code = f.read()
+    code = code.replace('SHEETS = {}\n', 'SHEETS = {0}\n'.format(pprint.pformat(sheets)), 1)
+    code = code.replace("INDEX_FILENAME = ''\n", 'INDEX_FILENAME = {0!r}\n'.format(index_filename), 1)
+    if string_table is not None:
+        code = code.replace("STRING_TABLE = ''\n", 'STRING_TABLE = {0!r}\n'.format(string_table_filename), 1)
+        code = code.replace('STRING_FIELDS = {}\n', 'STRING_FIELDS = {0}\n'.format(pprint.pformat(string_table.fields)), 1)
+    if manifest is not None:
+        manifest.write(loader_filepath, [code])
+        return
+    with open(loader_filepath, mode='w', encoding='utf-8') as f:
+        f.write(code)
+
+
+def iter_json_chunks(obj, convert=None):
+    """逐行生成JSON文本, 结果与json.dump(obj, ensure_ascii=False)相同
+
+    Args:
+        obj:list/dict, 有convert时可以是range
+        convert:function 不为None时每个元素(dict为每个value)先转换再生成JSON
+
+    Yields:
+        str
+    """
+    if type(obj) == list or (convert is not None and type(obj) == range):
+        yield '['
+        sep = ''
+        for x in obj:
+            if convert is not None:
+                x = convert(x)
+            yield sep + json.dumps(x, ensure_ascii=False)
+            sep = ', '
+        yield ']'
+    elif type(obj) == dict:
+        yield '{'
+        sep = ''
+        for k, v in obj.items():
+            if convert is not None:
+                v = convert(v)
+            # 借用json转换key, 保证int/float等类型的key与json.dump一致
+            yield sep + json.dumps({k: v}, ensure_ascii=False)[1:-1]
+            sep = ', '
+        yield '}'
+    else:
+        yield json.dumps(obj, ensure_ascii=False)
+
+
+def iter_json_sheet_chunks(sheet_name, sheet_data, schemas=None):
+    """生成一个表的JSON文本, 按行导出的list/dict表逐行转换为dict, 其它ExcelTable整个转换
+
+    Args:
+        schemas:RowSchemas get_row_schemas的结果, None表示数据中没有ExcelTable
+    """
+    if schemas is None or type(sheet_data) != ExcelTable:
+        return iter_json_chunks(sheet_data)
+    convert = schemas.get_row_converter(sheet_name)
+    if convert is None:
+        return iter_json_chunks(schemas.materialize_sheet(sheet_name, sheet_data))
+    return iter_json_chunks(schemas.get_positions(sheet_name), convert)
+
+
+def iter_json_pack_chunks(sheets, schemas=None):
+    """生成{sheet_name: data, ...}的JSON文本, sheet逐个生成
+
+    Args:
+        sheets: iterable of (sheet_name, data)
+        schemas:RowSchemas 见iter_json_sheet_chunks
+
+    Yields:
+        str
+    """
+    yield '{'
+    sep = ''
+    for sheet_name, sheet_data in sheets:
+        yield sep + json.dumps(sheet_name, ensure_ascii=False) + ': '
+        for chunk in iter_json_sheet_chunks(sheet_name, sheet_data, schemas):
+            yield chunk
+        sep = ', '
+    yield '}'
+
+
+def write_json_file(filepath, chunks, manifest=None, compress=False):
+    """把JSON文本块写入文件
+
+    Args:
+        filepath
+        chunks: iterable of str
+        manifest:OutputManifest 内容没有变化时不替换文件
+        compress:bool 同时导出manifest指定的压缩文件
+    """
+    if manifest is not None:
+        manifest.write(filepath, chunks, compress)
+        return
+    with open(filepath, mode='w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+class CompressedOutput:
+    """边序列化边压缩一个导出文件, 压缩、sha1和写文件在该压缩格式的线程(单线程, 按提交顺序执行)中进行,
+    zlib/lzma/hashlib和文件写入都会释放GIL, 与后面的序列化同时进行; 内存中最多只有几块原始数据
+    """
+    def __init__(self, filepath, compress_format, executor):
+        self.filepath = filepath
+        self.tmp_filepath = os.path.join(os.path.dirname(filepath), '.' + os.path.basename(filepath) + '.tmp')
+        self.executor = executor
+        self.futures = []
+        if compress_format == COMPRESS_GZIP:
+            # wbits=31为gzip格式, 头部mtime为0, 与gzip.compress(mtime=0)结果相同;
+            # 6与zlib默认相同, 比9快4倍左右, 大小只差几个百分点
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:
+            self.compressor = lzma.LZMACompressor()
+        self.h = hashlib.sha1()
+        self.f = open(self.tmp_filepath, mode='wb')
+
+    def _write(self, data):
+        if data:
+            self.h.update(data)
+            self.f.write(data)
+
+    def write(self, data):
+        """提交一块原始数据, 等待之前提交的块完成, 避免原始数据在队列中堆积"""
+        self.futures.append(self.executor.submit(lambda: self._write(self.compressor.compress(data))))
+        while len(self.futures) > 2:
+            self.futures.pop(0).result()
+
+    def _finish(self, keep):
+        self._write(self.compressor.flush())
+        self.f.close()
+        if not keep:
+            os.remove(self.tmp_filepath)
+            return None
+        os.replace(self.tmp_filepath, self.filepath)
+        st = os.stat(self.filepath)
+        return {'sha1': self.h.hexdigest(), 'size': st.st_size, 'mtime': st.st_mtime}
+
+    def finish(self, keep=True):
+        """Args:
+            keep:bool False时删除临时文件, 不替换压缩文件
+
+        Returns:
+            Future {sha1, size, mtime} keep为False时为None
+        """
+        return self.executor.submit(self._finish, keep)
+
+
+class OutputManifest:
+    """导出文件的manifest(export_dir下的.excel2json.manifest), 记录每个文件的sha1、大小和修改时间
+
+    文件先写到同目录的临时文件并计算sha1, 内容与上次相同时删除临时文件, 不同时用os.replace替换,
+    所以内容没有变化的文件不会被修改, 读取导出文件的程序也不会读到写了一半的文件。
+    指定compress_formats时数据文件同时导出压缩文件(.gz/.xz), 写原始文件时每一块同时交给压缩线程,
+    压缩文件的记录中另有原始文件的大小raw_size和sha1(raw_sha1)。
+    """
+    def __init__(self, export_dir, compress_formats=()):
+        self.export_dir = export_dir
+        self.filepath = os.path.join(export_dir, MANIFEST_FILENAME)
+        self.files = self.load()
+        self.changed = []
+        self.compress_formats = compress_formats
+        # 每种压缩格式一个线程, 同一个文件的块按顺序压缩
+        self.executors = {}
+        self.pending = []
+
+    def load(self):
+        """Returns:
+            dict filename => {sha1, size, mtime}
+        """
+        if not os.path.isfile(self.filepath):
+            return {}
+        try:
+            with open(self.filepath, encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            print('Warning:manifest is broken, ignore it. {0}'.format(self.filepath))
+            return {}
+
+    def save(self):
+        self.wait()
+        tmp_filepath = self.filepath + '.tmp'
+        with open(tmp_filepath, mode='w', encoding='utf-8') as f:
+            json.dump(self.files, f, ensure_ascii=False, indent=True, sort_keys=True)
+        os.replace(tmp_filepath, self.filepath)
+
+    def get_filename(self, filepath):
+        return os.path.relpath(filepath, self.export_dir).replace(os.sep, '/')
+
+    def is_same_file(self, filepath, filename):
+        """文件存在且大小和修改时间与manifest相同"""
+        entry = self.files.get(filename)
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        return bool(entry) and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime
+
+    def get_digest(self, filepath, filename):
+        """已有文件的sha1, 大小和修改时间与manifest相同时不重新计算
+
+        Returns:
+            str 文件不存在时为None
+        """
+        if self.is_same_file(filepath, filename):
+            return self.files[filename]['sha1']
+        if not os.path.isfile(filepath):
+            return None
+        return get_file_digest(filepath)
+
+    def write(self, filepath, chunks, compress=False):
+        """写入文件
+
+        Args:
+            filepath
+            chunks: iterable of str/bytes
+            compress:bool 同时导出compress_formats指定的压缩文件
+
+        Returns:
+            bool 内容有变化
+        """
+        filename = self.get_filename(filepath)
+        tmp_filepath = os.path.join(os.path.dirname(filepath), '.' + os.path.basename(filepath) + '.tmp')
+        outputs = []
+        if compress:
+            for compress_format in self.compress_formats:
+                if compress_format not in self.executors:
+                    self.executors[compress_format] = ThreadPoolExecutor(max_workers=1)
+                compress_filepath = filepath + COMPRESS_EXTENSIONS[compress_format]
+                outputs.append(CompressedOutput(compress_filepath, compress_format, self.executors[compress_format]))
+        batch = bytearray()
+        raw_size = 0
+        h = hashlib.sha1()
+        with open(tmp_filepath, mode='wb') as f:
+            for chunk in chunks:
+                if type(chunk) == str:
+                    chunk = chunk.encode('utf-8')
+                h.update(chunk)
+                f.write(chunk)
+                raw_size += len(chunk)
+                if not outputs:
+                    continue
+                if not batch and len(chunk) >= COMPRESS_BATCH_SIZE:
+                    # 大块(例如整个.bin文件)直接交给压缩线程, 不复制
+                    for output in outputs:
+                        output.write(chunk)
+                    continue
+                batch += chunk
+                if len(batch) >= COMPRESS_BATCH_SIZE:
+                    for output in outputs:
+                        output.write(bytes(batch))
+                    batch = bytearray()
+        if batch:
+            for output in outputs:
+                output.write(bytes(batch))
+        digest = h.hexdigest()
+
+        changed = digest != self.get_digest(filepath, filename)
+        if changed:
+            os.replace(tmp_filepath, filepath)
+            self.changed.append(filename)
+        else:
+            os.remove(tmp_filepath)
+        st = os.stat(filepath)
+        self.files[filename] = {'sha1': digest, 'size': st.st_size, 'mtime': st.st_mtime}
+
+        for output in outputs:
+            # 原始文件没有变化并且压缩文件还在时不替换压缩文件
+            compress_filename = self.get_filename(output.filepath)
+            entry = self.files.get(compress_filename)
+            keep = not (entry and entry.get('raw_sha1') == digest and self.is_same_file(output.filepath, compress_filename))
+            self.pending.append((compress_filename, raw_size, digest, output.finish(keep)))
+        return changed
+
+    def wait(self):
+        """等待压缩完成并记录压缩文件"""
+        for compress_filename, raw_size, raw_sha1, future in self.pending:
+            entry = future.result()
+            if entry is None:
+                continue
+            entry['raw_size'] = raw_size
+            entry['raw_sha1'] = raw_sha1
+            self.files[compress_filename] = entry
+            self.changed.append(compress_filename)
+        self.pending = []
+        for executor in self.executors.values():
+            executor.shutdown()
+        self.executors = {}
+
+    def print_changed(self):
+        self.wait()
+        if not self.changed:
+            print('No output changed.')
+            return
+        print('Changed outputs:')
+        for filename in self.changed:
+            print('  ' + filename)
+
+
+def get_export_groups(data, meta, merge_to_file, separate_type):
+    """按separate_type把sheet分组, 每组导出为一个文件
+
+    Args:
+        data:dict
+        meta:dict
+        merge_to_file:str separate_type=3时的文件名
+        separate_type:int 1按sheet分文件 2按excel分文件 3全部导出到一个文件
+
+    Returns:
+        list of (json_filename, sheet_names, is_pack) is_pack为False时文件内容是sheet数据本身
+        separate_type错误时返回None
+    """
+    if separate_type == 3:
+        # all in one
+        return [(merge_to_file, list(data), True)]
+    elif separate_type == 2:
+        # Separate with excel file
+        group = {}
+        for k in meta:
+            m = meta[k]
+            filename = m['filename']
+            if not filename in group:
+                group[filename] = []
+            group[filename].append(m['name'])
+
+        groups = []
+        for k in group:
+            sheet_names = [x for x in group[k] if x in data]
+            if sheet_names:
+                groups.append((k+'.json', sheet_names, True))
+        return groups
+    elif separate_type == 1:
+        # Separate with sheet
+        return [(k+'.json', [k], False) for k in data]
+    return None
+
+
+def get_shard_filename(sheet_name, i):
+    return '{0}.shard{1}.json'.format(sheet_name, i)
+
+
+def get_shard_index_filename(sheet_name):
+    return '{0}.shards.json'.format(sheet_name)
+
+
+def split_shard_positions(keys, shard_size, shard_by):
+    """按行数或主键范围把行分组
+
+    Args:
+        keys:list 每一行的主键
+        shard_size:int rows模式每个分片的行数, key模式每个分片的主键范围
+        shard_by:str rows/key
+
+    Returns:
+        (shard_by, list of (行下标列表, [开始key, 结束key))) 主键不是数字时key模式按rows拆分, 范围为None
+    """
+    if shard_by == SHARD_BY_KEY and all(type(k) in (int, float) for k in keys):
+        buckets = {}
+        for i, k in enumerate(keys):
+            buckets.setdefault(int(k // shard_size), []).append(i)
+        return (SHARD_BY_KEY, [(buckets[b], [b * shard_size, (b + 1) * shard_size]) for b in sorted(buckets)])
+    n = len(keys)
+    return (SHARD_BY_ROWS, [(range(i, min(i + shard_size, n)), None) for i in range(0, n, shard_size)])
+
+
+def get_key_bounds(keys):
+    """分片中主键的最小值和最大值, 类型不同无法比较时为None"""
+    try:
+        return (min(keys), max(keys))
+    except (TypeError, ValueError):
+        return (None, None)
+
+
+def assemble_shards(data, meta, shard_size, shard_by=SHARD_BY_ROWS):
+    """把行数多的list/dict表拆分成分片, 每个分片单独导出, 并生成主键范围到分片文件的索引
+
+    key模式下list表的行按分片顺序重新排列(分片内保持原来的顺序), data中的表替换为按分片顺序组装的数据,
+    之后的补丁、加载模块的索引与分片文件一致
+
+    Args:
+        data:dict
+        meta:dict
+        shard_size:int rows模式每个分片的行数, key模式每个分片的主键范围
+        shard_by:str rows/key
+
+    Returns:
+        dict sheet_name => (index, list of 分片数据)
+    """
+    shards = {}
+    for sheet_name, sheet_data in data.items():
+        m = meta[sheet_name]
+        layout = m.get('layout', LAYOUT_ROWS)
+        if m['type'] not in (CON_LIST, CON_DICT) or layout == LAYOUT_POOL or not m['fields']:
+            continue
+        pk = m['fields'][0]['name']
+        if layout == LAYOUT_COLUMNAR:
+            keys = sheet_data['columns'][pk]
+        elif type(sheet_data) == dict:
+            keys = list(sheet_data)
+        elif sheet_data and type(sheet_data[0]) == dict:
+            keys = [row[pk] for row in sheet_data]
+        else:
+            # 简单数组
+            continue
+
+        sheet_shard_by, groups = split_shard_positions(keys, shard_size, shard_by)
+        if len(groups) < 2:
+            continue
+        if sheet_shard_by != shard_by:
+            print('Warning:primary key of [{0}] is not a number, shard by rows'.format(sheet_name))
+
+        shard_datas = []
+        index_shards = []
+        for i, (positions, key_range) in enumerate(groups):
+            if layout == LAYOUT_COLUMNAR:
+                columns = {}
+                for name, column in sheet_data['columns'].items():
+                    if type(positions) == range:
+                        columns[name] = column[positions.start:positions.stop]
+                    else:
+                        columns[name] = [column[x] for x in positions]
+                shard_data = {'count': len(positions), 'columns': columns}
+            elif type(sheet_data) == dict:
+                shard_data = {keys[x]: sheet_data[keys[x]] for x in positions}
+            else:
+                shard_data = [sheet_data[x] for x in positions]
+            shard_datas.append(shard_data)
+
+            key_min, key_max = get_key_bounds([keys[x] for x in positions])
+            shard = {'file': get_shard_filename(sheet_name, i), 'count': len(positions), 'min': key_min, 'max': key_max}
+            if key_range:
+                shard['range'] = key_range
+            index_shards.append(shard)
+
+        if sheet_shard_by == SHARD_BY_KEY:
+            if layout == LAYOUT_COLUMNAR:
+                data[sheet_name] = {'count': len(keys), 'columns': {
+                    name: list(chain.from_iterable(x['columns'][name] for x in shard_datas)) for name in sheet_data['columns']}}
+            elif type(sheet_data) == dict:
+                data[sheet_name] = dict(chain.from_iterable(x.items() for x in shard_datas))
+            else:
+                data[sheet_name] = list(chain.from_iterable(shard_datas))
+
+        index = {'sheet': sheet_name, 'type': m['type'], 'layout': layout, 'primary_key': pk,
+                 'shard_by': sheet_shard_by, 'count': len(keys), 'shards': index_shards}
+        shards[sheet_name] = (index, shard_datas)
+    return shards
+
+
+def write_export_file(export_dir, json_filename, sheets, is_pack, export_formats, profiler=None, manifest=None,
+                      schemas=None):
+    """按export_formats导出一个文件
+
+    Args:
+        json_filename:str 导出bin时扩展名替换为.bin
+        sheets:list of (sheet_name, sheet_data)
+        is_pack:bool False时文件内容是第一个sheet的数据本身
+        schemas:RowSchemas get_row_schemas的结果, 数据中有ExcelTable时需要
+    """
+    for export_format in export_formats:
+        if export_format == FORMAT_JSON:
+            json_filepath = os.path.join(export_dir, json_filename)
+            if is_pack:
+                chunks = iter_json_pack_chunks(sheets, schemas)
+            else:
+                chunks = iter_json_sheet_chunks(sheets[0][0], sheets[0][1], schemas)
+            with profile_stage(profiler, 'dump', json_filename):
+                write_json_file(json_filepath, chunks, manifest, True)
+        elif export_format == FORMAT_BIN:
+            bin_filepath = os.path.join(export_dir, os.path.splitext(json_filename)[0]+'.bin')
+            if schemas is not None:
+                sheets = [(k, schemas.materialize_sheet(k, v)) for k, v in sheets]
+            if is_pack:
+                obj = dict(sheets)
+            else:
+                obj = sheets[0][1]
+            with profile_stage(profiler, 'dump', os.path.basename(bin_filepath)):
+                if manifest is not None:
+                    manifest.write(bin_filepath, [binconf.dumps(obj)], True)
+                else:
+                    binconf.dump(obj, bin_filepath)
+        else:
+            print('Error:export_format [{0}] is not supported'.format(export_format))
+
+
+def export_files(data, meta, export_dir, merge_to_file, separate_type, export_formats, only_sheets=None, profiler=None,
+                 manifest=None, shards=None, string_table=None, schemas=None):
+    """导出数据文件, 每组文件写完后从data中移除, 可以尽早释放内存
+
+    Args:
+        data:dict
+        meta:dict
+        export_dir
+        merge_to_file:str separate_type=3时的文件名
+        separate_type:int 1按sheet分文件 2按excel分文件 3全部导出到一个文件
+        export_formats:list json/bin
+        only_sheets:set 只导出包含这些sheet的文件, None表示全部导出
+        profiler:Profiler
+        manifest:OutputManifest 内容没有变化的文件不重写
+        shards:dict assemble_shards的结果, 这些表不放入separate_type的分组, 分片和索引单独导出
+        string_table:StringTable 写文件时把字符串字段转换为字符串表的下标
+        schemas:RowSchemas get_row_schemas的结果, data中有ExcelTable时需要, 写文件时才转换为dict
+    """
+    def get_sheet_data(sheet_name, sheet_data):
+        if string_table is None:
+            return sheet_data
+        return string_table.convert_sheet(sheet_name, sheet_data, meta[sheet_name])
+
+    shards = shards or {}
+    for sheet_name in shards:
+        data.pop(sheet_name, None)
+
+    groups = get_export_groups(data, meta, merge_to_file, separate_type)
+    if groups is None:
+        print("Error:separate_type value error.")
+        return
+
+    for json_filename, sheet_names, is_pack in groups:
+        if only_sheets is not None and not only_sheets.intersection(sheet_names):
+            continue
+        sheets = [(k, get_sheet_data(k, data[k])) for k in sheet_names]
+        write_export_file(export_dir, json_filename, sheets, is_pack, export_formats, profiler, manifest, schemas)
+        for sheet_name in sheet_names:
+            del data[sheet_name]
+
+    for sheet_name, (index, shard_datas) in shards.items():
+        if only_sheets is not None and sheet_name not in only_sheets:
+            continue
+        for shard, shard_data in zip(index['shards'], shard_datas):
+            write_export_file(export_dir, shard['file'], [(sheet_name, get_sheet_data(sheet_name, shard_data))], False,
+                              export_formats, profiler, manifest, schemas)
+        index_filename = get_shard_index_filename(sheet_name)
+        with profile_stage(profiler, 'dump', index_filename):
+            write_json_file(os.path.join(export_dir, index_filename), iter_json_chunks(index), manifest, True)
+
+
+def json_key(key):
+    """dict的key在JSON中的字符串, 与json.dump转换key的规则相同"""
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def diff_dict(old, new):
+    """按key比较dict表(或object表的字段)
+
+    Returns:
+        {added:{key:row}, removed:[key], changed:{key:row}} 没有变化时返回None, 大部分行都有变化时返回{full:new}
+    """
+    added = {}
+    changed = {}
+    for k, v in new.items():
+        if k not in old:
+            added[k] = v
+        elif old[k] != v:
+            changed[k] = v
+    removed = [json_key(k) for k in old if k not in new]
+    if not (added or removed or changed):
+        return None
+    if len(added) + len(changed) >= len(new):
+        return {'full': new}
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def get_row_keys(rows, key_field):
+    """list表每一行的主键, 主键不唯一或者不能作为dict的key时返回None"""
+    if not key_field:
+        return None
+    try:
+        keys = [row[key_field] for row in rows]
+        if len(set(keys)) != len(keys):
+            return None
+    except (TypeError, KeyError):
+        return None
+    return keys
+
+
+def diff_list(old, new, key_field):
+    """比较list表, 主键(第一个字段)在新旧两个版本中都唯一时按主键识别行, 否则按行号识别
+
+    Returns:
+        {key, added:[[index, row]], removed:[id], changed:[row]或[[index, row]]}
+        key为None时id是行号; 保留下来的行顺序变化或者大部分行都有变化时返回{full:new}; 没有变化时返回None
+    """
+    old_keys = get_row_keys(old, key_field)
+    new_keys = get_row_keys(new, key_field) if old_keys is not None else None
+    if new_keys is None:
+        n = min(len(old), len(new))
+        changed = [[i, new[i]] for i in range(n) if old[i] != new[i]]
+        removed = list(range(n, len(old)))
+        added = [[i, new[i]] for i in range(n, len(new))]
+        key_field = None
+    else:
+        old_index = dict(zip(old_keys, old))
+        new_index = set(new_keys)
+        kept = [k for k in old_keys if k in new_index]
+        if kept != [k for k in new_keys if k in old_index]:
+            return {'full': new}
+        changed = [row for k, row in zip(new_keys, new) if k in old_index and old_index[k] != row]
+        removed = [k for k in old_keys if k not in new_index]
+        added = [[i, row] for i, (k, row) in enumerate(zip(new_keys, new)) if k not in old_index]
+    if not (added or removed or changed):
+        return None
+    if len(added) + len(changed) >= len(new):
+        return {'full': new}
+    return {'key': key_field, 'added': added, 'removed': removed, 'changed': changed}
+
+
+def get_columnar_rows(data, field_names):
+    columns = [data['columns'][x] for x in field_names]
+    return [dict(zip(field_names, values)) for values in zip(*columns)]
+
+
+def get_matrix_rows(con_type, data):
+    """把各种格式的矩阵还原为每行的值(没有值的单元格为0)
+
+    Returns:
+        list of row list
+    """
+    nrows = len(data['row_head'])
+    ncols = len(data['col_head'])
+    if con_type == CON_MATRIX:
+        mat = data['matrix']
+        return [mat[r*ncols:(r+1)*ncols] for r in range(nrows)]
+
+    mat_rows = [[0] * ncols for _ in range(nrows)]
+    if con_type == CON_MATRIX_CSR_STD:
+        indptr, indices, values = data['indptr'], data['indices'], data['data']
+        for r in range(len(indptr) - 1):
+            row = mat_rows[r]
+            for i in range(indptr[r], indptr[r+1]):
+                row[indices[i]] = values[i]
+    elif con_type == CON_MATRIX_COO:
+        for r, c, v in zip(data['row'], data['col'], data['data']):
+            mat_rows[r][c] = v
+    elif con_type == CON_MATRIX_CSR:
+        mat = data['matrix']
+        row_count = mat[0]
+        for i in range(row_count):
+            r, start = mat[1 + i*2], mat[2 + i*2]
+            end = mat[2 + (i+1)*2] if i + 1 < row_count else len(mat)
+            row = mat_rows[r]
+            for j in range(start, end, 2):
+                row[mat[j]] = mat[j+1]
+    return mat_rows
+
+
+def build_matrix(con_type, mat_rows):
+    if con_type == CON_MATRIX_CSR_STD:
+        return build_matrix_csr_std(mat_rows)
+    if con_type == CON_MATRIX_COO:
+        return build_matrix_coo(mat_rows)
+    if con_type == CON_MATRIX_CSR:
+        return build_matrix_csr(mat_rows)
+    return build_matrix_dense(mat_rows)
+
+
+def diff_matrix(con_type, old, new):
+    """按单元格比较矩阵, 行头或列头变化时返回{full:new}
+
+    Returns:
+        {cells:[[r, c, value]]} 稀疏矩阵中没有值的单元格value为0, 没有变化时返回None
+    """
+    if old['row_head'] != new['row_head'] or old['col_head'] != new['col_head']:
+        return {'full': new}
+    cells = []
+    for r, (old_row, new_row) in enumerate(zip(get_matrix_rows(con_type, old), get_matrix_rows(con_type, new))):
+        if old_row != new_row:
+            cells.extend([r, c, v] for c, (o, v) in enumerate(zip(old_row, new_row)) if o != v)
+    if not cells:
+        return None
+    # 变化的单元格比矩阵本身的数据还多时直接导出整个矩阵
+    if len(cells) >= len(new['data'] if 'data' in new else new['matrix']):
+        return {'full': new}
+    return {'cells': cells}
+
+
+def diff_sheet(old_meta, meta, old, new):
+    """比较一个sheet的两个版本
+
+    Args:
+        old_meta:dict 上一版本的meta[sheet_name]
+        meta:dict
+        old: 上一版本导出的数据
+        new:
+
+    Returns:
+        dict sheet的补丁, 没有变化时返回None
+    """
+    if old == new:
+        return None
+    con_type = meta['type']
+    layout = meta.get('layout', LAYOUT_ROWS)
+    if old_meta.get('type') != con_type or old_meta.get('layout', LAYOUT_ROWS) != layout \
+            or old_meta.get('fields') != meta['fields']:
+        return {'full': new}
+
+    if con_type in CON_MATRIX_TYPES:
+        return diff_matrix(con_type, old, new)
+    field_names = [x['name'] for x in meta['fields']]
+    key_field = field_names[0] if field_names else None
+    if layout == LAYOUT_COLUMNAR:
+        return diff_list(get_columnar_rows(old, field_names), get_columnar_rows(new, field_names), key_field)
+    if type(new) == dict:
+        return diff_dict(old, new)
+    return diff_list(old, new, key_field)
+
+
+def assemble_patch(old_meta, old_data, meta, data):
+    """比较两次导出的数据, 每个sheet按key建立索引, 比较的时间与数据量成正比
+
+    Returns:
+        {sheets:{sheet_name:patch}, removed_sheets:[sheet_name]}
+    """
+    sheets = {}
+    for sheet_name, sheet_data in data.items():
+        if sheet_name not in old_data:
+            sheets[sheet_name] = {'full': sheet_data}
+            continue
+        patch = diff_sheet(old_meta.get(sheet_name, {}), meta[sheet_name], old_data[sheet_name], sheet_data)
+        if patch is not None:
+            sheets[sheet_name] = patch
+    removed_sheets = [x for x in old_data if x not in data]
+    return {'sheets': sheets, 'removed_sheets': removed_sheets}
+
+
+def apply_list_patch(rows, patch):
+    """把diff_list的补丁应用到list表(JSON读取的数据)"""
+    key_field = patch['key']
+    if key_field:
+        ids = [row[key_field] for row in rows]
+        changed = {row[key_field]: row for row in patch['changed']}
+    else:
+        ids = range(len(rows))
+        changed = {i: row for i, row in patch['changed']}
+    removed = set(patch['removed'])
+    kept = [changed.get(k, row) for k, row in zip(ids, rows) if k not in removed]
+
+    result = []
+    added = patch['added']
+    i = 0
+    for row in kept:
+        while i < len(added) and added[i][0] == len(result):
+            result.append(added[i][1])
+            i += 1
+        result.append(row)
+    result.extend(row for _, row in added[i:])
+    return result
+
+
+def apply_sheet_patch(meta, sheet_data, patch):
+    """把一个sheet的补丁应用到上一版本的数据(JSON读取的数据)
+
+    Args:
+        meta:dict meta[sheet_name]
+        sheet_data:
+        patch:dict
+
+    Returns:
+        新版本的数据
+    """
+    if 'full' in patch:
+        return patch['full']
+    con_type = meta['type']
+    if con_type in CON_MATRIX_TYPES:
+        mat_rows = get_matrix_rows(con_type, sheet_data)
+        for r, c, v in patch['cells']:
+            mat_rows[r][c] = v
+        data = build_matrix(con_type, mat_rows)
+        data['col_head'] = sheet_data['col_head']
+        data['row_head'] = sheet_data['row_head']
+        return data
+    if 'key' not in patch:
+        removed = set(patch['removed'])
+        data = {k: v for k, v in sheet_data.items() if k not in removed}
+        data.update(patch['changed'])
+        data.update(patch['added'])
+        return data
+    if meta.get('layout', LAYOUT_ROWS) == LAYOUT_COLUMNAR:
+        field_names = [x['name'] for x in meta['fields']]
+        rows = apply_list_patch(get_columnar_rows(sheet_data, field_names), patch)
+        return {'count': len(rows), 'columns': {x: [row[x] for row in rows] for x in field_names}}
+    return apply_list_patch(sheet_data, patch)
+
+
+def apply_patch(meta, data, patch):
+    """把write_patch生成的补丁文件应用到上一版本的数据
+
+    Args:
+        meta:dict 新版本的meta
+        data:dict sheet_name => 上一版本的数据, 会被修改
+        patch:dict 补丁文件的内容
+
+    Returns:
+        data
+    """
+    for sheet_name in patch['removed_sheets']:
+        data.pop(sheet_name, None)
+    for sheet_name, sheet_patch in patch['sheets'].items():
+        data[sheet_name] = apply_sheet_patch(meta[sheet_name], data.get(sheet_name), sheet_patch)
+    return data
+
+
+def write_patch(patch_dir, data, meta):
+    """与上一次导出的数据比较, 生成补丁文件patch_<version>.json并更新版本链patches.json
+
+    上一次导出的数据和meta保存在patch_dir下的.excel2json.snapshot, 第一次运行时只保存快照(版本0)。
+
+    Args:
+        patch_dir
+        data:dict
+        meta:dict
+    """
+    if not os.path.isdir(patch_dir):
+        os.makedirs(patch_dir)
+    snapshot_filepath = os.path.join(patch_dir, SNAPSHOT_FILENAME)
+    chain_filepath = os.path.join(patch_dir, PATCH_CHAIN_FILENAME)
+
+    snapshot = None
+    if os.path.isfile(snapshot_filepath):
+        try:
+            with open(snapshot_filepath, mode='rb') as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            print('Warning:patch snapshot is broken, ignore it. {0}'.format(snapshot_filepath))
+
+    patch_chain = {'version': 0, 'patches': []}
+    if os.path.isfile(chain_filepath):
+        with open(chain_filepath, encoding='utf-8') as f:
+            patch_chain = json.load(f)
+
+    if snapshot is None or snapshot['version'] != patch_chain['version']:
+        if patch_chain['patches']:
+            print('Warning:patch snapshot does not match {0}, start a new patch chain.'.format(chain_filepath))
+        patch_chain = {'version': 0, 'patches': []}
+    else:
+        patch = assemble_patch(snapshot['meta'], snapshot['data'], meta, data)
+        if not (patch['sheets'] or patch['removed_sheets']):
+            print('Patch: no change since version {0}'.format(patch_chain['version']))
+            return
+        version = patch_chain['version'] + 1
+        patch['base'] = patch_chain['version']
+        patch['version'] = version
+        patch_filename = 'patch_{0}.json'.format(version)
+        patch_filepath = os.path.join(patch_dir, patch_filename)
+        write_json_file(patch_filepath, iter_json_chunks(patch))
+        patch_chain['version'] = version
+        patch_chain['patches'].append({
+            'version': version,
+            'base': patch['base'],
+            'file': patch_filename,
+            'sha1': get_file_digest(patch_filepath),
+            'sheets': list(patch['sheets']),
+            'removed_sheets': patch['removed_sheets'],
+        })
+        print('Patch: version {0} => {1} {2}'.format(patch['base'], version, ','.join(patch['sheets'])))
+
+    # 先保存快照再更新版本链, 中断时两者版本不同, 下次运行会重新开始
+    tmp_filepath = snapshot_filepath + '.tmp'
+    with open(tmp_filepath, mode='wb') as f:
+        pickle.dump({'version': patch_chain['version'], 'meta': meta, 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filepath, snapshot_filepath)
+    tmp_filepath = chain_filepath + '.tmp'
+    with open(tmp_filepath, mode='w', encoding='utf-8') as f:
+        json.dump(patch_chain, f, ensure_ascii=False, indent=True)
+    os.replace(tmp_filepath, chain_filepath)
+
+
+def write_outputs(info_dict, excel_dir, export_dir, merge_to_file, separate_type, export_formats, loader,
+                  only_sheets=None, foreign_ref=False, profiler=None, patch_dir='', compress_formats=(),
+                  report_filepath='', strict=False, shard_size=0, shard_by=SHARD_BY_ROWS, string_table='',
+                  meta_filepath=None):
+    """打印校验错误, 检查meta后导出数据文件和加载模块, patch_dir不为空时生成与上一次导出相比的补丁
+    meta_filepath为None时检查并更新excel_dir下的.meta.txt, 为空字符串时不检查也不写meta
+    compress_formats(gzip/lzma)不为空时数据文件同时导出压缩文件, 写文件时原始数据按块交给压缩线程, 与序列化同时进行
+    shard_size大于0时行数多的list/dict表按行数(shard_by=rows)或主键范围(shard_by=key)拆分导出
+    string_table不为空时字符串字段导出为共用字符串表(string_table文件)的下标, 下标与所有导出文件有关, 总是全部导出
+
+    Returns:
+        bool meta有变化或者strict模式下有校验错误, 没有导出时返回False
+    """
+    report = assemble_validation_report(info_dict)
+    print_validation_report(report, report_filepath)
+    if strict and report:
+        print('Error:strict mode, nothing is exported.')
+        return False
+
+    with profile_stage(profiler, 'assemble'):
+        data, meta = assemble_export(info_dict, foreign_ref)
+        schemas = get_row_schemas(info_dict, foreign_ref)
+        # 这些功能按字段名访问行, 先整体转换为dict; 否则写文件时逐行转换
+        if patch_dir or loader or shard_size > 0 or string_table:
+            data = materialize_data(data, schemas)
+
+    table = None
+    if string_table:
+        table = StringTable(info_dict, foreign_ref)
+        table.mark_meta(meta)
+        only_sheets = None
+
+    if meta_filepath is None:
+        meta_filepath = os.path.join(excel_dir,'.meta.txt')
+    changed_items = diff_meta(meta_filepath, meta) if meta_filepath else None
+
+    if changed_items:
+        print("Error:")
+        print('Those are excel files which field defines are changed.')
+        print(changed_items)
+        print('Please check out carefully. \nIf you make sure to create new meta file, please delete \".meta.txt\" at first.\n')
+        return False
+
+    if meta_filepath:
+        with open(meta_filepath, mode='w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=True)
+
+    shards = {}
+    if shard_size > 0:
+        with profile_stage(profiler, 'shard'):
+            shards = assemble_shards(data, meta, shard_size, shard_by)
+
+    if patch_dir:
+        with profile_stage(profiler, 'patch'):
+            write_patch(patch_dir, data, meta)
+
+    manifest = OutputManifest(export_dir, compress_formats)
+    if loader:
+        with profile_stage(profiler, 'loader', loader):
+            index_dict = assemble_index_dict(info_dict, data)
+            write_loader_module(os.path.join(export_dir, loader), data, meta, index_dict, merge_to_file,
+                                separate_type, manifest, shards, table, string_table)
+
+    export_files(data, meta, export_dir, merge_to_file, separate_type, export_formats, only_sheets, profiler,
+                 manifest, shards, table, schemas)
+    if table is not None:
+        write_export_file(export_dir, string_table, [('', table.strings)], False, export_formats, profiler, manifest)
+    with profile_stage(profiler, 'compress'):
+        manifest.save()
+    manifest.print_changed()
+    if table is not None:
+        print_string_table_report(table)
+    return True
+
+
+class Exporter:
+    """库接口, 在同一个进程中多次解析或导出, 不需要每次启动excel2json.py
+
+        exporter = excel2json.Exporter('excels')
+        data, meta = exporter.parse(filter_string='c')      # 只在内存中返回, 不写文件
+        data, meta = exporter.parse(filter_string='c', foreign_ref=True)
+        exporter.export('out', filter_string='s', export_formats=['json', 'bin'])
+
+    每个文件按filter_string解析后的结果(pickle)保存在内存中, 文件大小和修改时间不变时不再重新读取;
+    过滤在读取表头时完成, 不同的filter_string第一次使用时分别解析, 之后columnar、foreign_ref、导出格式等不同的导出都复用。
+    只有export和cache_filepath不为None时写文件。
+    """
+    def __init__(self, excel_dir='./', ignore_filenames=(), jobs=1, cache_filepath=None):
+        """
+        Args:
+            excel_dir
+            ignore_filenames:list 排除的表格
+            jobs 并行读取的进程数量, 1表示在当前进程读取
+            cache_filepath 解析缓存文件, None表示不使用缓存(默认, 不写文件)
+        """
+        self.excel_dir = excel_dir
+        self.ignore_filenames = list(ignore_filenames)
+        self.jobs = jobs
+        self.cache_filepath = cache_filepath
+
+        self.stats = {}         # filename => (size, mtime)
+        self.raw = {}           # (filename, filter_string) => pickle(ExcelSheetInfo list)
+
+    def clear(self):
+        """丢弃内存中的解析结果"""
+        self.stats = {}
+        self.raw = {}
+
+    def read(self, filter_string='', profiler=None):
+        """读取目录下的Excel文件, 没有修改过的文件使用内存中的解析结果
+
+        Returns:
+            dict 未处理的info_dict, 每次返回新的对象
+        """
+        stats = get_excel_stats(self.excel_dir, self.ignore_filenames)
+        for key in list(self.raw):
+            if stats.get(key[0]) != self.stats.get(key[0]):
+                del self.raw[key]
+        self.stats = stats
+
+        filenames = list(stats)
+        missing = [x for x in filenames if not (x, filter_string) in self.raw]
+        if missing:
+            results = read_excel_files(self.excel_dir, missing, self.jobs, self.cache_filepath, profiler, filter_string)
+            for filename, sheet_infos in zip(missing, results):
+                self.raw[(filename, filter_string)] = pickle.dumps(sheet_infos, protocol=pickle.HIGHEST_PROTOCOL)
+        return merge_sheet_infos([pickle.loads(self.raw[(x, filter_string)]) for x in filenames], True)
+
+    def process(self, filter_string='', columnar=False, profiler=None):
+        """读取并完成外链、数组合并
+
+        Returns:
+            dict info_dict
+        """
+        info_dict = self.read(filter_string, profiler)
+        process_info_dict(info_dict, columnar, profiler)
+        return info_dict
+
+    def parse(self, filter_string='', columnar=False, foreign_ref=False):
+        """与parse()相同, 结果只在内存中
+
+        Returns:
+            (data_dict, meta_dict) 行都是dict
+        """
+        info_dict = self.process(filter_string, columnar)
+        data, meta = assemble_export(info_dict, foreign_ref)
+        return (materialize_data(data, get_row_schemas(info_dict, foreign_ref)), meta)
+
+    def validate(self, filter_string=''):
+        """数据校验的错误, 不导出
+
+        Returns:
+            list 见assemble_validation_report
+        """
+        return assemble_validation_report(self.process(filter_string))
+
+    def export(self, export_dir, filter_string='', merge_to_file='config.json', separate_type=3,
+               export_formats=(FORMAT_JSON,), loader='', columnar=False, foreign_ref=False, profiler=None, patch_dir='',
+               compress_formats=(), report_filepath='', strict=False, shard_size=0, shard_by=SHARD_BY_ROWS,
+               string_table='', meta_filepath=None):
+        """导出到export_dir, 参数和结果与命令行相同
+
+        meta按导出目录分别检查: meta_filepath为None时使用export_dir下的.meta.txt(目录不存在时创建), 不同的过滤条件、导出方式
+        导出到不同的目录时互不影响; 为空字符串时不检查也不写meta
+
+        Returns:
+            bool 见write_outputs
+        """
+        if meta_filepath is None:
+            meta_filepath = os.path.join(export_dir, '.meta.txt')
+        if not os.path.isdir(export_dir):
+            os.makedirs(export_dir)
+        info_dict = self.process(filter_string, columnar, profiler)
+        return write_outputs(info_dict, self.excel_dir, export_dir, merge_to_file, separate_type, list(export_formats),
+                             loader, foreign_ref=foreign_ref, profiler=profiler, patch_dir=patch_dir,
+                             compress_formats=compress_formats, report_filepath=report_filepath, strict=strict,
+                             shard_size=shard_size, shard_by=shard_by, string_table=string_table,
+                             meta_filepath=meta_filepath)
+
+
+class ExcelWatcher:
+    """--watch 模式, 轮询excel_dir, 只重新解析修改过的Excel文件
+
+    内存中保存每个文件解析后未处理的数据(pickle)和上一次处理完成的info_dict。
+    文件修改后, 只对修改的表、通过外键引用它的表(以及这些表引用的外表)重新做外链、过滤和数组合并,
+    并且只重写包含这些表的导出文件。
+    """
+    def __init__(self, excel_dir, export_dir, filter_string, ignore_filenames, merge_to_file,
+                 separate_type, export_formats, loader, jobs=1, cache_filepath=None, columnar=False, foreign_ref=False,
+                 patch_dir='', compress_formats=(), report_filepath='', strict=False, shard_size=0,
+                 shard_by=SHARD_BY_ROWS, string_table=''):
+        self.excel_dir = excel_dir
+        self.export_dir = export_dir
+        self.filter_string = filter_string
+        self.ignore_filenames = ignore_filenames
+        self.merge_to_file = merge_to_file
+        self.separate_type = separate_type
+        self.export_formats = export_formats
+        self.loader = loader
+        self.jobs = jobs
+        self.cache_filepath = cache_filepath
+        self.columnar = columnar
+        self.foreign_ref = foreign_ref
+        self.patch_dir = patch_dir
+        self.compress_formats = compress_formats
+        self.report_filepath = report_filepath
+        self.strict = strict
+        self.shard_size = shard_size
+        self.shard_by = shard_by
+        self.string_table = string_table
+
+        self.stats = {}         # filename => (size, mtime)
+        self.raw = {}           # filename => pickle(ExcelSheetInfo list)
+        self.file_keys = {}     # filename => info_dict key
+        self.references = {}    # info_dict key => 外键引用的info_dict key
+        self.info_dict = {}
+
+    def scan(self):
+        return get_excel_stats(self.excel_dir, self.ignore_filenames)
+
+    def load(self, filename, sheet_infos):
+        self.raw[filename] = pickle.dumps(sheet_infos, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file_keys[filename] = os.path.splitext(filename)[0].replace('+', '').replace('-', '')
+        # 先清掉文件上一次的外键引用, 修改后删掉的外键不能再影响get_affected_keys
+        self.references.pop(self.file_keys[filename], None)
+        for sheet_info in sheet_infos:
+            self.references[sheet_info.filename] = set(f.foreign_key.sheet_name for f in sheet_info.fields if f.foreign_key)
+
+    def build(self):
+        """第一次全部读取"""
+        self.stats = self.scan()
+        filenames = list(self.stats)
+        results = read_excel_files(self.excel_dir, filenames, self.jobs, self.cache_filepath, filter_string=self.filter_string)
+        for filename, sheet_infos in zip(filenames, results):
+            self.load(filename, sheet_infos)
+        self.info_dict = merge_sheet_infos([pickle.loads(self.raw[x]) for x in filenames], True)
+        process_info_dict(self.info_dict, self.columnar)
+        write_outputs(self.info_dict, self.excel_dir, self.export_dir, self.merge_to_file, self.separate_type,
+                      self.export_formats, self.loader, foreign_ref=self.foreign_ref,
+                      patch_dir=self.patch_dir, compress_formats=self.compress_formats,
+                      report_filepath=self.report_filepath, strict=self.strict, shard_size=self.shard_size,
+                      shard_by=self.shard_by, string_table=self.string_table)
+
+    def get_affected_keys(self, changed_keys):
+        """changed_keys以及通过外键(直接或间接)引用它们的表"""
+        affected = set(changed_keys)
+        pending = list(changed_keys)
+        while pending:
+            key = pending.pop()
+            for parent, refs in self.references.items():
+                if key in refs and not parent in affected:
+                    affected.add(parent)
+                    pending.append(parent)
+        return affected
+
+    def get_referenced_keys(self, keys):
+        """keys以及它们(直接或间接)引用的外表"""
+        result = set(keys)
+        pending = list(keys)
+        while pending:
+            key = pending.pop()
+            for ref in self.references.get(key, ()):
+                if not ref in result:
+                    result.add(ref)
+                    pending.append(ref)
+        return result
+
+    def update(self):
+        """检查文件变化并重新导出
+
+        Returns:
+            list 修改过的文件, 没有变化时为空
+        """
+        stats = self.scan()
+        changed = [x for x in stats if self.stats.get(x) != stats[x]]
+        removed = [x for x in self.stats if not x in stats]
+        if not changed and not removed:
+            return []
+
+        for filename in changed:
+            try:
+                sheet_infos = parse_excel_file(os.path.join(self.excel_dir, filename), filter_string=self.filter_string)
+            except Exception as e:
+                # 文件可能还在保存中, 下次轮询再读取
+                print('Error:read {0} failed. {1}'.format(filename, e))
+                stats[filename] = self.stats.get(filename)
+                continue
+            self.load(filename, sheet_infos)
+        changed_keys = set()
+        for filename in removed:
+            key = self.file_keys.pop(filename)
+            changed_keys.add(key)
+            del self.raw[filename]
+            self.references.pop(key, None)
+        for filename in changed:
+            if filename in self.file_keys:
+                changed_keys.add(self.file_keys[filename])
+        self.stats = stats
+
+        affected = self.get_affected_keys(changed_keys)
+        rebuild_keys = self.get_referenced_keys(affected)
+        filenames = [x for x in sorted(self.raw) if self.file_keys[x] in rebuild_keys]
+        sub_info_dict = merge_sheet_infos([pickle.loads(self.raw[x]) for x in filenames], True)
+        process_info_dict(sub_info_dict, self.columnar)
+
+        # 保持与全部读取时相同的顺序
+        info_dict = {}
+        for filename in sorted(self.raw):
+            key = self.file_keys[filename]
+            if key in sub_info_dict:
+                info_dict[key] = sub_info_dict[key]
+            elif key in self.info_dict and not key in rebuild_keys:
+                info_dict[key] = self.info_dict[key]
+        self.info_dict = info_dict
+
+        only_sheets = set(info_dict[x].name for x in affected if x in info_dict)
+        for key in changed_keys:
+            if not key in info_dict:
+                only_sheets.add(key)
+        write_outputs(self.info_dict, self.excel_dir, self.export_dir, self.merge_to_file, self.separate_type,
+                      self.export_formats, self.loader, only_sheets, self.foreign_ref,
+                      patch_dir=self.patch_dir, compress_formats=self.compress_formats,
+                      report_filepath=self.report_filepath, strict=self.strict, shard_size=self.shard_size,
+                      shard_by=self.shard_by, string_table=self.string_table)
+        return changed + removed
+
+    def run(self, interval):
+        start = time.time()
+        self.build()
+        print('Watching {0} ... {1:.2f}s'.format(self.excel_dir, time.time() - start))
+        try:
+            while True:
+                time.sleep(interval)
+                start = time.time()
+                changed = self.update()
+                if changed:
+                    print('Rebuild {0} {1:.2f}s'.format(','.join(changed), time.time() - start))
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--excel_dir', default='./')
+    args.add_argument('--export_dir', default='./')
+    args.add_argument('--filter', default='', help='Filter string. "c,s"')
+    args.add_argument('--ignore', default='', help='Ignore list. "Item,Goods"')
+    args.add_argument('--merge_to_file', default='config.json', help='It is used when iseparate_type=3 ')
+    args.add_argument('--separate_type', default= 3, type=int, help="1 separate with sheet, 2 separate with file  3 all in one")
+    args.add_argument('--chdir', default=None)
+    args.add_argument('--param', default=None, help='init argument file')
+    args.add_argument('--export_format', default=FORMAT_JSON, help='Export formats. "json,bin"')
+    args.add_argument('--columnar', action='store_true', help='Export all list/dict sheets by columns')
+    args.add_argument('--foreign_ref', action='store_true', help='Export foreign rows once and store row indexes in parent sheets')
+    args.add_argument('--loader', default='', help='Generate a python loader module. "config_loader.py"')
+    args.add_argument('--compress', default='', help='Also write compressed copies of exported files. "gzip,lzma"')
+    args.add_argument('--report', default='', help='Write the validation errors to a json file. "report.json"')
+    args.add_argument('--strict', action='store_true', help='Do not export and exit with 1 if there are validation errors')
+    args.add_argument('--shard_size', default=0, type=int, help='Split list/dict sheets into shards of n rows (or n keys with --shard_by key)')
+    args.add_argument('--shard_by', default=SHARD_BY_ROWS, help='Shard by "rows" or primary "key" range')
+    args.add_argument('--string_table', default='', help='Export string fields as indexes of a shared string table. "strings.json"')
+    args.add_argument('--patch_dir', default='', help='Write a patch against the previous export and a version chain to this directory')
+    args.add_argument('--watch', action='store_true', help='Keep running and re-export when excel files change')
+    args.add_argument('--watch_interval', default=0.5, type=float, help='Seconds between two scans of excel_dir in watch mode')
+    args.add_argument('--jobs', default=1, type=int, help='Number of processes used to read excel files')
+    args.add_argument('--profile', default='', help='Write a per workbook/sheet/stage profile report. "profile.json"')
+    args.add_argument('--profile_top', default=10, type=int, help='Number of the slowest stages printed with --profile')
+    args.add_argument('--cprofile', default='', help='Dump cProfile stats of the whole run. "excel2json.prof"')
+    args.add_argument('--cache_dir', default='', help='Directory of the parse cache, the user cache directory by default')
+    args.add_argument('--no_cache', action='store_true', help='Do not read or write the parse cache')
+    args.add_argument('--clear_cache', action='store_true', help='Delete the parse cache before reading excel files')
+    arg = args.parse_args()
+
+    if arg.param:
+        if os.path.exists(arg.param):
+            with open(arg.param, mode='r', encoding='utf-8') as f:
+                param = json.load(f)
+                chdir = param.get('chdir', None)
+                ignore = param.get('ignore', '')
+                filter = param.get('filter', '')
+                excel_dir = param.get('excel_dir', './')            
+                export_dir = param.get('export_dir', './')
+                merge_to_file = param.get('merge_to_file', 'config.json')
+                separate_type = param.get('separate_type', 3)
+                export_format = param.get('export_format', FORMAT_JSON)
+                columnar = param.get('columnar', False)
+                foreign_ref = param.get('foreign_ref', False)
+                loader = param.get('loader', '')
+                patch_dir = param.get('patch_dir', '')
+                compress = param.get('compress', '')
+                report = param.get('report', '')
+                strict = param.get('strict', False)
+                shard_size = param.get('shard_size', 0)
+                shard_by = param.get('shard_by', SHARD_BY_ROWS)
+                string_table = param.get('string_table', '')
+                watch = param.get('watch', False)
+                watch_interval = param.get('watch_interval', 0.5)
+                jobs = param.get('jobs', 1)
+                profile = param.get('profile', '')
+                profile_top = param.get('profile_top', 10)
+                cprofile = param.get('cprofile', '')
+                cache_dir = param.get('cache_dir', '')
+                no_cache = param.get('no_cache', False)
+                clear_cache = param.get('clear_cache', False)
+        else:
+            param = {                
+                'excel_dir':'./',
+                'export_dir':'./',
+                'merge_to_file':'config.json',
+                'separate_type':3,
+                'ignore':'',
+                'filter':'',
+                'jobs':1,
+                'cache_dir':'',
+                'no_cache':False,
+                'clear_cache':False,
+            }
+            with open(arg.param, mode='w', encoding='utf-8') as f:
+                json.dump(param, f, ensure_ascii=False, indent=True)
+            print('{0} is created.... first time. This time i did not read excel files'.format(arg.param))
+            return
+            
+    else:
+        chdir = arg.chdir
+        ignore = arg.ignore
+        filter = arg.filter
+        excel_dir = arg.excel_dir        
+        export_dir = arg.export_dir
+        merge_to_file = arg.merge_to_file
+        separate_type = arg.separate_type
+        export_format = arg.export_format
+        columnar = arg.columnar
+        foreign_ref = arg.foreign_ref
+        loader = arg.loader
+        patch_dir = arg.patch_dir
+        compress = arg.compress
+        report = arg.report
+        strict = arg.strict
+        shard_size = arg.shard_size
+        shard_by = arg.shard_by
+        string_table = arg.string_table
+        watch = arg.watch
+        watch_interval = arg.watch_interval
+        jobs = arg.jobs
+        profile = arg.profile
+        profile_top = arg.profile_top
+        cprofile = arg.cprofile
+        cache_dir = arg.cache_dir
+        no_cache = arg.no_cache
+        clear_cache = arg.clear_cache
+
+    if chdir:
+        os.chdir(chdir)
+    
+    cache_filepath = get_cache_filepath(excel_dir, cache_dir)
+    if clear_cache and os.path.isfile(cache_filepath):
+        os.remove(cache_filepath)
+    if no_cache:
+        cache_filepath = None
+
+    ignore_filenames = ignore.split(',')
+    export_formats = export_format.split(',')
+    compress_formats = [x for x in compress.split(',') if x]
+    for compress_format in compress_formats:
+        if compress_format not in COMPRESS_EXTENSIONS:
+            print('Error:compress format [{0}] is not supported'.format(compress_format))
+            return
+    if shard_by not in (SHARD_BY_ROWS, SHARD_BY_KEY):
+        print('Error:shard_by [{0}] is not supported'.format(shard_by))
+        return
+    if watch:
+        watcher = ExcelWatcher(excel_dir, export_dir, filter, ignore_filenames, merge_to_file, separate_type,
+                               export_formats, loader, jobs, cache_filepath, columnar, foreign_ref, patch_dir,
+                               compress_formats, report, strict, shard_size, shard_by, string_table)
+        watcher.run(watch_interval)
+        return
+
+    profiler = Profiler() if profile else None
+    cprofiler = None
+    if cprofile:
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+
+    info_dict = parse_info_dict(excel_dir, filter, ignore_filenames, jobs, cache_filepath, columnar, profiler)
+    exported = write_outputs(info_dict, excel_dir, export_dir, merge_to_file, separate_type, export_formats, loader,
+                             foreign_ref=foreign_ref, profiler=profiler, patch_dir=patch_dir,
+                             compress_formats=compress_formats, report_filepath=report, strict=strict,
+                             shard_size=shard_size, shard_by=shard_by, string_table=string_table)
+
+    if cprofiler:
+        cprofiler.disable()
+        cprofiler.dump_stats(cprofile)
+    if profiler:
+        profiler.dump(profile, profile_top)
+    if strict and not exported:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,249 @@
+"""配置加载模块, 由excel2json.py --loader 根据meta生成, 请不要手动修改
+
+    import config_loader
+    config = config_loader.Config()
+    config.Item                     # 第一次访问时才读取JSON
+    config.get('Item', 101)         # 按主键(第一个字段)查找一行
+    config.find('Item', 101)        # 按主键查找所有行
+    config.referencing('Bundle', 'items', 101)  # 外键字段引用了该key的行
+    config.cell('Buff', r, c)       # 矩阵单元格, CSR/COO为O(log n)
+    config.shards('Drop', 101)      # --shard_size分片导出的表, 只读取主键范围包含该key的分片
+"""
+import os
+import json
+from bisect import bisect_left
+
+
+# sheet_name => {type, layout, file, packed, primary_key, refs, shards}
+SHEETS = {}
+
+INDEX_FILENAME = ''
+
+# --string_table 字符串表文件, 以及每个表中导出为下标的字段
+# sheet_name => {field: true(string/string[]) 或 {foreign, result_type}(嵌入的外表行) 或 {items}}
+STRING_TABLE = ''
+STRING_FIELDS = {}
+
+
+def index_key(values):
+    """索引的key, 与导出时的规则相同"""
+    return ','.join(json.dumps(v, ensure_ascii=False) for v in values)
+
+
+class Config:
+    def __init__(self, export_dir=None):
+        self.export_dir = export_dir or os.path.dirname(os.path.abspath(__file__))
+        self._files = {}
+        self._sheets = {}
+        self._index = None
+        self._strings = None
+
+    def __getattr__(self, name):
+        if name in SHEETS:
+            return self.sheet(name)
+        raise AttributeError(name)
+
+    def _read_file(self, filename):
+        with open(os.path.join(self.export_dir, filename), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_file(self, filename):
+        if filename not in self._files:
+            self._files[filename] = self._read_file(filename)
+        return self._files[filename]
+
+    def _load_shards(self, info):
+        """按顺序读取所有分片组装成整个sheet"""
+        parts = [self._files.pop(x['file'], None) or self._read_file(x['file'])
+                 for x in self._load_file(info['shards'])['shards']]
+        if info['layout'] == 'columnar':
+            columns = {k: [v for x in parts for v in x['columns'][k]] for k in parts[0]['columns']}
+            return {'count': sum(x['count'] for x in parts), 'columns': columns}
+        if info['type'] == 'dict':
+            return {k: v for x in parts for k, v in x.items()}
+        return [row for x in parts for row in x]
+
+    def shards(self, name, key):
+        """分片导出的表中主键范围可能包含key的分片数据(list), 只读取这些分片
+
+        按行数拆分的分片之间主键范围可能重叠, 结果可能有多个分片; --string_table导出的字符串字段仍然是下标
+        """
+        result = []
+        for x in self._load_file(SHEETS[name]['shards'])['shards']:
+            try:
+                if 'range' in x:
+                    found = x['range'][0] <= key < x['range'][1]
+                else:
+                    found = x['min'] is not None and x['min'] <= key <= x['max']
+            except TypeError:
+                found = False
+            if found:
+                result.append(self._load_file(x['file']))
+        return result
+
+    def _decode_value(self, value, entry):
+        """字符串表的下标还原为字符串"""
+        if value is None:
+            return None
+        if entry is True:
+            return self._strings[value] if type(value) == int else [self._strings[x] for x in value]
+        if 'items' in entry:
+            return [self._decode_value(x, entry['items']) for x in value]
+        if entry['result_type'] == 'list' and type(value) == list:
+            return [self._decode_row(entry['foreign'], x) for x in value]
+        if entry['result_type'] == 'dict' and type(value) == dict:
+            return {k: self._decode_row(entry['foreign'], x) for k, x in value.items()}
+        return self._decode_row(entry['foreign'], value)
+
+    def _decode_row(self, name, row):
+        if not isinstance(row, dict):
+            return row
+        for k, entry in STRING_FIELDS[name].items():
+            if k in row:
+                row[k] = self._decode_value(row[k], entry)
+        return row
+
+    def _decode_sheet(self, name, info, data):
+        if self._strings is None:
+            self._strings = self._load_file(STRING_TABLE)
+        fields = STRING_FIELDS[name]
+        if info['layout'] == 'columnar':
+            for k, entry in fields.items():
+                data['columns'][k] = [self._decode_value(x, entry) for x in data['columns'][k]]
+        elif info['type'] == 'object':
+            self._decode_row(name, data)
+        elif isinstance(data, dict):
+            for row in data.values():
+                self._decode_row(name, row)
+        elif data and not isinstance(data[0], dict):
+            # 简单数组
+            data[:] = [self._decode_value(x, fields['_']) for x in data]
+        else:
+            for row in data:
+                self._decode_row(name, row)
+
+    def sheet(self, name):
+        """sheet数据, 与导出的JSON相同; --foreign_ref导出的外键字段还原为外表的行, --string_table导出的下标还原为字符串"""
+        if name not in self._sheets:
+            info = SHEETS[name]
+            if info.get('shards'):
+                data = self._load_shards(info)
+            else:
+                data = self._load_file(info['file'])
+                data = data[name] if info['packed'] else data
+            if name in STRING_FIELDS:
+                self._decode_sheet(name, info, data)
+            self._sheets[name] = data
+            if info.get('refs'):
+                self._resolve_refs(info, data)
+        return self._sheets[name]
+
+    def _resolve_refs(self, info, data):
+        """把外键字段中的行号替换为引用池中的行, 同一行在所有主表中是同一个对象"""
+        for field, ref in info['refs'].items():
+            pool = self.sheet(ref['sheet'])
+
+            def resolve(v):
+                if ref.get('items') and type(v) == list:
+                    # 元素是外键的数组(q_0..q_N), 每个元素分别还原
+                    return [self._resolve_ref(x, ref['result_type'], pool) for x in v]
+                return self._resolve_ref(v, ref['result_type'], pool)
+
+            if info['layout'] == 'columnar':
+                data['columns'][field] = [resolve(v) for v in data['columns'][field]]
+            else:
+                for row in (data.values() if isinstance(data, dict) else data):
+                    row[field] = resolve(row[field])
+
+    def _resolve_ref(self, v, result_type, pool):
+        """行号是int; 没有找到外链对象或外键为空时是原来的值(字符串的list), 原样返回"""
+        if result_type == 'list' and type(v) == list and all(type(i) == int for i in v):
+            return [pool[i] for i in v]
+        if result_type == 'dict' and type(v) == dict:
+            return {k: pool[i] for k, i in v.items()}
+        if result_type == 'object' and type(v) == int:
+            return pool[v]
+        return v
+
+    def index(self, name):
+        """导出时预先计算的索引 {primary_key:{key:[locator]}, foreign_keys:{field:{key:[locator]}}}"""
+        if self._index is None:
+            self._index = self._load_file(INDEX_FILENAME)
+        return self._index.get(name, {})
+
+    def row(self, name, locator):
+        """按位置(list表、按列导出的表和引用池)或key(dict表)取一行"""
+        data = self.sheet(name)
+        if SHEETS[name]['layout'] == 'columnar':
+            return {k: column[locator] for k, column in data['columns'].items()}
+        return data[locator]
+
+    def find(self, name, *key):
+        """按主键查找所有行"""
+        locators = self.index(name).get('primary_key', {}).get(index_key(key), [])
+        return [self.row(name, x) for x in locators]
+
+    def get(self, name, *key, default=None):
+        """按主键查找一行"""
+        info = SHEETS[name]
+        if info['type'] == 'dict' and info['layout'] == 'rows' and len(key) == 1:
+            k = key[0]
+            json_key = k if isinstance(k, str) else json.dumps(k)
+            if info.get('shards') and name not in self._sheets and not info.get('refs') and name not in STRING_FIELDS:
+                for data in self.shards(name, k):
+                    if json_key in data:
+                        return data[json_key]
+                return default
+            return self.sheet(name).get(json_key, default)
+        rows = self.find(name, *key)
+        return rows[0] if rows else default
+
+    def referencing(self, name, field, *key):
+        """外键字段引用了外表中key对应行的所有行"""
+        locators = self.index(name).get('foreign_keys', {}).get(field, {}).get(index_key(key), [])
+        return [self.row(name, x) for x in locators]
+
+    def cell(self, name, r, c):
+        """矩阵第r行第c列的值(从0开始), 不存在时为0"""
+        info = SHEETS[name]
+        data = self.sheet(name)
+        con_type = info['type']
+        if con_type == 'matrix':
+            return data['matrix'][r * len(data['col_head']) + c]
+        if con_type == 'matrix(csr_std)':
+            indptr, indices = data['indptr'], data['indices']
+            lo, hi = indptr[r], indptr[r + 1]
+            i = bisect_left(indices, c, lo, hi)
+            return data['data'][i] if i < hi and indices[i] == c else 0
+        if con_type == 'matrix(coo)':
+            rows, cols = data['row'], data['col']
+            lo = bisect_left(rows, r)
+            hi = bisect_left(rows, r + 1, lo)
+            i = bisect_left(cols, c, lo, hi)
+            return data['data'][i] if i < hi and cols[i] == c else 0
+        if con_type == 'matrix(csr)':
+            # [非空行数量, (行号, 开始下标) * 非空行数量, (列号, 值) * n]
+            mat = data['matrix']
+            row_count = mat[0]
+            lo, hi = 0, row_count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if mat[1 + mid * 2] < r:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == row_count or mat[1 + lo * 2] != r:
+                return 0
+            start = mat[2 + lo * 2]
+            end = mat[2 + (lo + 1) * 2] if lo + 1 < row_count else len(mat)
+            lo, hi = 0, (end - start) // 2
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if mat[start + mid * 2] < c:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < (end - start) // 2 and mat[start + lo * 2] == c:
+                return mat[start + lo * 2 + 1]
+            return 0
+        raise Exception('{0} is not a matrix'.format(name))
@@ -0,0 +1,366 @@
+"""只读的.xlsx流式读取, excel2json.py读取.xlsx时使用(xlrd 2.0之后不再支持.xlsx)
+
+    book = xlsxreader.open_workbook('Item.xlsx')
+    sh = book.sheet_by_index(0)
+    sh.cell(0, 0).value             # 前几行按需读取并缓存
+    for row in sh.iter_rows(5):     # 之后的行边解压边解析, 不缓存
+        ...
+
+.xlsx是zip文件, sheet的XML按块解压, 每块中完整的<row>用正则表达式解析, 内存中只有当前块和共享字符串表。
+比ElementTree解析整个sheet快, 内存不随行数增长。
+提供xlrd book/sheet接口中excel2json.py用到的部分, 单元格的值与xlrd相同:
+数字为float, 字符串为str, 布尔为1/0, 空单元格和错误为''。
+nrows/ncols/col_values需要读取整个sheet, 读取后每一行补齐到ncols。
+"""
+import re
+import codecs
+import zipfile
+import posixpath
+from html import unescape
+import xml.etree.ElementTree as ET
+
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+CHUNK_SIZE = 1 << 20
+
+_prefix_re = re.compile(r'<(\w+:)?worksheet\b')
+_si_re = re.compile(r'<si\b[^>]*?(?:/>|>(.*?)</si>)', re.S)
+_t_re = re.compile(r'<t\b[^>]*?(?:/>|>(.*?)</t>)', re.S)
+_rph_re = re.compile(r'<rPh\b.*?</rPh>', re.S)
+_row_r_re = re.compile(r'\br="(\d+)"')
+
+
+def get_column_index(letters):
+    """'A' => 0, 'AA' => 26"""
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def get_text(xml):
+    """<is>或<si>中所有<t>的文本(富文本按顺序拼接, 忽略注音)"""
+    if '<rPh' in xml:
+        xml = _rph_re.sub('', xml)
+    text = ''.join(x for x in _t_re.findall(xml))
+    return unescape(text) if '&' in text else text
+
+
+class Cell:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class SheetParser:
+    """解析sheet XML中完整的<row>
+
+    Excel等程序写出的单元格r属性都在最前面(<c r="A1" s="1" t="s">), 用一个正则表达式解析整块,
+    单元格数量对不上时(没有r属性、属性顺序不同或者有其它子元素)这一块按行逐个解析。
+    """
+    def __init__(self, prefix, shared_strings):
+        self.shared_strings = shared_strings
+        p = re.escape(prefix)
+        # 属性以/结尾时是<c .../>; 只有一个<t>的内联字符串直接取文本
+        self.fast_cell_re = re.compile(
+            r'<{0}c r="([A-Z]+)(\d+)"([^>]*)>(?:(?<=/>)|(?:<{0}f\b[^>]*>(?:[^<]*</{0}f>)?)?'
+            r'(?:<{0}v>([^<]*)</{0}v>)?(?:<{0}is><{0}t>([^<]*)</{0}t></{0}is>|<{0}is>(.*?)</{0}is>)?</{0}c>)'.format(p), re.S)
+        self.row_re = re.compile(r'<{0}row\b([^>]*?)(?:/>|>(.*?)</{0}row>)'.format(p), re.S)
+        # r和t属性的顺序不固定, 用前瞻分别匹配
+        self.cell_re = re.compile(
+            r'<{0}c\b(?=(?:[^>]*?\br="([A-Z]+)\d+")?)(?=(?:[^>]*?\bt="(\w+)")?)[^>]*?(?:/>|>(.*?)</{0}c>)'.format(p), re.S)
+        self.v_re = re.compile(r'<{0}v>([^<]*)</{0}v>'.format(p))
+        self.cell_tags = ('<{0}c '.format(prefix), '<{0}c>'.format(prefix))
+        self.columns = {}
+        self.types = {}
+
+    def value(self, t, v, inline):
+        if t == 'inlineStr':
+            return get_text(inline) if inline else ''
+        if not v:
+            return ''
+        if not t or t == 'n':
+            return float(v)
+        if t == 's':
+            return self.shared_strings[int(v)]
+        if t == 'str' or t == 'd':
+            return unescape(v) if '&' in v else v
+        if t == 'b':
+            return int(v)
+        # e: 错误
+        return ''
+
+    def parse(self, text):
+        """Returns:
+            list of (行号, 单元格值) 没有r属性的行行号为None
+        """
+        cells = self.fast_cell_re.findall(text)
+        if len(cells) != text.count(self.cell_tags[0]) + text.count(self.cell_tags[1]):
+            return self.parse_rows(text)
+
+        rows = []
+        columns = self.columns
+        types = self.types
+        shared_strings = self.shared_strings
+        current = None
+        row = None
+        for col, rnum, attrs, v, text, inline in cells:
+            if rnum != current:
+                current = rnum
+                row = []
+                rows.append((int(rnum) - 1, row))
+            c = columns.get(col)
+            if c is None:
+                c = columns[col] = get_column_index(col)
+            if c > len(row):
+                row.extend([''] * (c - len(row)))
+            if attrs:
+                t = types.get(attrs)
+                if t is None:
+                    i = attrs.find(' t="')
+                    t = types[attrs] = attrs[i+4:attrs.index('"', i+4)] if i >= 0 else ''
+                if attrs[-1] == '/':
+                    row.append('')
+                    continue
+            else:
+                t = ''
+            if not t and v:
+                row.append(float(v))
+            elif t == 's':
+                row.append(shared_strings[int(v)])
+            elif t == 'inlineStr' and not inline:
+                row.append(unescape(text) if '&' in text else text)
+            else:
+                row.append(self.value(t, v, inline))
+        for r, row in rows:
+            while row and row[-1] == '':
+                row.pop()
+        return rows
+
+    def parse_rows(self, text):
+        rows = []
+        for attrs, body in self.row_re.findall(text):
+            m = _row_r_re.search(attrs)
+            row = []
+            rows.append((int(m.group(1)) - 1 if m else None, row))
+            if not body:
+                continue
+            for ref, t, inner in self.cell_re.findall(body):
+                if ref:
+                    c = get_column_index(ref)
+                    if c > len(row):
+                        row.extend([''] * (c - len(row)))
+                m = self.v_re.search(inner) if inner else None
+                row.append(self.value(t, m.group(1) if m else '', inner))
+            while row and row[-1] == '':
+                row.pop()
+        return rows
+
+
+class XlsxSheet:
+    def __init__(self, book, name, path):
+        self.book = book
+        self.name = name
+        self.path = path
+        self._rows = []
+        self._reader = None
+        self._loaded = False
+        self._streamed = False
+
+    def _open(self):
+        if self._reader is None:
+            self._reader = self.book.iter_sheet_rows(self.path)
+        return self._reader
+
+    def _read_to(self, r):
+        """缓存前r+1行"""
+        if self._streamed:
+            raise Exception('{0} has been read by iter_rows'.format(self.name))
+        reader = self._open()
+        rows = self._rows
+        while len(rows) <= r and not self._loaded:
+            row = next(reader, None)
+            if row is None:
+                self._loaded = True
+                self._pad_rows()
+            else:
+                rows.append(row)
+
+    def _pad_rows(self):
+        ncols = max(len(x) for x in self._rows) if self._rows else 0
+        for row in self._rows:
+            if len(row) < ncols:
+                row.extend([''] * (ncols - len(row)))
+
+    def has_rows(self, n):
+        """是否至少有n行, 只读取前n行"""
+        if n <= 0:
+            return True
+        self._read_to(n - 1)
+        return len(self._rows) >= n
+
+    def load(self):
+        """读取整个sheet"""
+        self._read_to(float('inf'))
+
+    @property
+    def nrows(self):
+        self.load()
+        return len(self._rows)
+
+    @property
+    def ncols(self):
+        self.load()
+        return len(self._rows[0]) if self._rows else 0
+
+    def cell(self, r, c):
+        self._read_to(r)
+        row = self._rows[r]
+        return Cell(row[c] if c < len(row) else '')
+
+    def row_values(self, r, start_colx=0, end_colx=None):
+        self._read_to(r)
+        return self._rows[r][start_colx:end_colx]
+
+    def col_values(self, c, start_rowx=0, end_rowx=None):
+        self.load()
+        return [row[c] if c < len(row) else '' for row in self._rows[start_rowx:end_rowx]]
+
+    def iter_rows(self, start_rowx=0):
+        """从start_rowx开始逐行读取, 已缓存的行直接返回, 之后的行不再缓存, 行不补齐
+
+        调用之后不能再用其它接口访问这个sheet
+        """
+        r = start_rowx
+        while r < len(self._rows):
+            yield self._rows[r]
+            r += 1
+        if self._loaded:
+            return
+        self._streamed = True
+        reader = self._open()
+        # 跳过start_rowx之前还没有缓存的行
+        for i in range(len(self._rows), r):
+            if next(reader, None) is None:
+                return
+        self._rows = []
+        for row in reader:
+            yield row
+
+    def unload(self):
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = None
+        self._rows = []
+
+
+class XlsxBook:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.zip = zipfile.ZipFile(filepath)
+        self.shared_strings = []
+        self.sheets = []
+        self._load_workbook()
+
+    def _read_xml(self, path):
+        return ET.fromstring(self.zip.read(path))
+
+    def _load_workbook(self):
+        rels = {}
+        shared_strings_path = 'xl/sharedStrings.xml'
+        try:
+            root = self._read_xml('xl/_rels/workbook.xml.rels')
+            for rel in root.iter(NS_PKG_REL + 'Relationship'):
+                target = rel.get('Target', '')
+                if target.startswith('/'):
+                    path = target[1:]
+                else:
+                    path = posixpath.normpath(posixpath.join('xl', target))
+                rels[rel.get('Id')] = path
+                if rel.get('Type', '').endswith('/sharedStrings'):
+                    shared_strings_path = path
+        except KeyError:
+            pass
+
+        root = self._read_xml('xl/workbook.xml')
+        for i, sheet in enumerate(root.iter(NS_MAIN + 'sheet')):
+            path = rels.get(sheet.get(NS_REL + 'id'), 'xl/worksheets/sheet{0}.xml'.format(i + 1))
+            self.sheets.append(XlsxSheet(self, sheet.get('name'), path))
+
+        if shared_strings_path in self.zip.namelist():
+            self.shared_strings = self._read_shared_strings(shared_strings_path)
+
+    def _read_shared_strings(self, path):
+        strings = []
+        for text in self.iter_xml_text(path, '</si>'):
+            strings.extend(get_text(x) if x else '' for x in _si_re.findall(text))
+        return strings
+
+    def iter_xml_text(self, path, end_tag):
+        """按块解压XML, 每块在最后一个end_tag之后截断, 剩下的部分并入下一块"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        buf = ''
+        with self.zip.open(path) as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                buf += decoder.decode(data, not data)
+                if not data:
+                    yield buf
+                    return
+                end = buf.rfind(end_tag)
+                if end >= 0:
+                    end += len(end_tag)
+                    yield buf[:end]
+                    buf = buf[end:]
+
+    def iter_sheet_rows(self, path):
+        """逐行返回sheet的单元格值, 空行为[]"""
+        with self.zip.open(path) as f:
+            head = f.read(4096)
+        prefix = ''
+        m = _prefix_re.search(head.decode('utf-8', 'ignore'))
+        if m and m.group(1):
+            prefix = m.group(1)
+        parser = SheetParser(prefix, self.shared_strings)
+
+        next_r = 0
+        for text in self.iter_xml_text(path, '</{0}row>'.format(prefix)):
+            for r, row in parser.parse(text):
+                if r is None:
+                    r = next_r
+                while next_r < r:
+                    yield []
+                    next_r += 1
+                next_r = r + 1
+                yield row
+
+    @property
+    def nsheets(self):
+        return len(self.sheets)
+
+    def sheet_names(self):
+        return [x.name for x in self.sheets]
+
+    def sheet_by_index(self, i):
+        return self.sheets[i]
+
+    def unload_sheet(self, i):
+        self.sheets[i].unload()
+
+    def release_resources(self):
+        for sheet in self.sheets:
+            sheet.unload()
+        self.zip.close()
+
+
+def open_workbook(filepath):
+    """打开.xlsx文件, sheet在访问时才读取
+
+    Returns:
+        XlsxBook
+    """
+    return XlsxBook(filepath)